@@ -1,3 +1,44 @@
 #!/bin/sh
-./mine.sh &
-bitcoind -conf=/home/bitcoin/.bitcoin/bitcoin.conf -datadir=/home/bitcoin/data -printtoconsole -regtest -maxconnections=1024
+if [ -n "$RESTORE_CHECKPOINT" ]; then
+    # wait for the manager to upload the checkpoint of this container
+    while [ ! -f /tmp/checkpoint.restored ]; do sleep 0.5; done
+    tar xf /tmp/checkpoint.tar -C /
+    # fee estimates are only written on shutdown, fall back to the snapshot ones
+    if [ ! -f /home/bitcoin/data/regtest/fee_estimates.dat ]; then
+        cp /home/bitcoin/snapshot/regtest/fee_estimates.dat /home/bitcoin/data/regtest/
+    fi
+    SNAPSHOT_ARGS="-maxtipage=2147483647 -acceptstalefeeestimates"
+    echo bootstrapped > /tmp/bootstrapped
+    ./mine.sh &
+elif [ -n "$BTC_NODE_SNAPSHOT" ] && [ -d /home/bitcoin/snapshot/regtest ]; then
+    cp -a /home/bitcoin/snapshot/. /home/bitcoin/data/
+    # the snapshot tip and fee estimates are as old as the image
+    SNAPSHOT_ARGS="-maxtipage=2147483647 -acceptstalefeeestimates"
+    echo bootstrapped > /tmp/bootstrapped
+    ./mine.sh &
+else
+    if [ -n "$BTC_NODE_SNAPSHOT" ]; then
+        echo "no snapshot in this image (built without SNAPSHOT=1), bootstrapping the chain"
+    fi
+    # the manager waits for the marker, the chain looks ready midway through the fee loop
+    (./bootstrap.sh && echo bootstrapped > /tmp/bootstrapped && ./mine.sh) &
+fi
+bitcoind_() {
+    exec bitcoind -conf=/home/bitcoin/.bitcoin/bitcoin.conf -datadir=/home/bitcoin/data -printtoconsole -regtest -maxconnections=1024 $SNAPSHOT_ARGS
+}
+if [ -n "$SAVE_CHECKPOINT" ]; then
+    # stop bitcoind while the manager copies the checkpoint, then start it again;
+    # mine.sh cannot mine in between
+    bitcoind_ &
+    PID=$!
+    while [ ! -f /tmp/checkpoint.hold ] && kill -0 $PID 2>/dev/null; do sleep 0.5; done
+    if [ ! -f /tmp/checkpoint.hold ]; then
+        wait $PID
+        exit $?
+    fi
+    kill $PID
+    wait $PID
+    echo stopped > /tmp/checkpoint.stopped
+    while [ ! -f /tmp/checkpoint.resume ]; do sleep 0.5; done
+fi
+bitcoind_
@@ -0,0 +1,11 @@
+#!/bin/sh
+# Bootstraps a regtest chain into /home/bitcoin/snapshot at image build time,
+# so nodes started with BTC_NODE_SNAPSHOT skip mining and fee bootstrapping.
+mkdir -p /home/bitcoin/snapshot
+bitcoind -conf=/home/bitcoin/.bitcoin/bitcoin.conf -datadir=/home/bitcoin/snapshot -regtest -daemon
+./bootstrap.sh > /dev/null
+bitcoin-cli stop
+while pidof bitcoind > /dev/null
+do
+    sleep 1
+done
@@ -1,3 +1,37 @@
 #!/bin/bash
-# Starts the RPC server on 28183
-python3 /jm/clientserver/scripts/jmwalletd.py > /home/joinmarket/jmwalletd.log 2>&1
+# Starts one RPC server per wallet. jmwalletd serves a single wallet, so wallet
+# i gets its own data directory, RPC port 28183+i and websocket port 29183+i.
+if [ -n "$RESTORE_CHECKPOINT" ]; then
+    # wait for the manager to upload the checkpoint of this container
+    while [ ! -f /tmp/checkpoint.restored ]; do sleep 0.5; done
+    tar xf /tmp/checkpoint.tar -C /
+    # wallets were open when the checkpoint was taken
+    rm -f /home/joinmarket/.joinmarket*/wallets/.*.lock
+fi
+WALLETS=${JM_WALLETS:-1}
+start_wallets() {
+    for ((i = 0; i < WALLETS; i++)); do
+        if [ "$i" -eq 0 ]; then
+            DATADIR=/home/joinmarket/.joinmarket
+            LOG=/home/joinmarket/jmwalletd.log
+        else
+            DATADIR=/home/joinmarket/.joinmarket-$i
+            LOG=/home/joinmarket/jmwalletd-$i.log
+            mkdir -p "$DATADIR"
+            cp -r /home/joinmarket/.joinmarket/ssl /home/joinmarket/.joinmarket/joinmarket.cfg "$DATADIR"/
+        fi
+        python3 /jm/clientserver/scripts/jmwalletd.py --datadir="$DATADIR" -p $((28183 + i)) -w $((29183 + i)) >> "$LOG" 2>&1 &
+    done
+}
+start_wallets
+if [ -n "$SAVE_CHECKPOINT" ]; then
+    # stop the wallet daemons while the manager copies the checkpoint, then start them again
+    while [ ! -f /tmp/checkpoint.hold ]; do sleep 0.5; done
+    kill $(jobs -p)
+    wait
+    rm -f /home/joinmarket/.joinmarket*/wallets/.*.lock
+    echo stopped > /tmp/checkpoint.stopped
+    while [ ! -f /tmp/checkpoint.resume ]; do sleep 0.5; done
+    start_wallets
+fi
+wait
@@ -0,0 +1,11 @@
+#!/bin/sh
+CONFIG=/tmp/tinyproxy.conf
+cp /etc/tinyproxy/tinyproxy.conf $CONFIG
+for ADDRESS in $ALLOW; do
+    echo "Allow $ADDRESS" >> $CONFIG
+done
+# without ConnectPort lines tinyproxy accepts CONNECT to any port, 0 disables it
+for PORT in ${CONNECT_PORTS:-0}; do
+    echo "ConnectPort $PORT" >> $CONFIG
+done
+exec tinyproxy -d -c $CONFIG
@@ -6,6 +6,14 @@ fi
 if [ -z "$ADDR_WASABI_BACKEND" ]; then
     export ADDR_WASABI_BACKEND="wasabi-backend"
 fi
+if [ -n "$RESTORE_CHECKPOINT" ]; then
+    # wait for the manager to upload the checkpoint of this container
+    while [ ! -f /tmp/checkpoint.restored ]; do sleep 0.5; done
+    tar xf /tmp/checkpoint.tar -C /
+fi
 mkdir -p /home/wasabi/.walletwasabi/client
 ( echo "cat <<EOF" ; cat /home/wasabi/Config.json ; echo EOF ) | sh > /home/wasabi/.walletwasabi/client/Config.json
-./WalletWasabi.Fluent.Desktop
\ No newline at end of file
+daemon() {
+    exec ./WalletWasabi.Fluent.Desktop
+}
+. "$(dirname "$0")/checkpoint.sh"
@@ -0,0 +1,30 @@
+# Sourced by run.sh once it defines `daemon`, which runs the wallet daemon.
+#
+# With SAVE_CHECKPOINT set, the manager stops the daemon while it copies the
+# checkpoint: on /tmp/checkpoint.hold the daemon is stopped and
+# /tmp/checkpoint.stopped reports it, on /tmp/checkpoint.resume it is started
+# again. Otherwise, or afterwards, the daemon replaces the script.
+if [ -n "$SAVE_CHECKPOINT" ]; then
+    # job control gives the daemon a process group of its own, so stopping it
+    # also stops the processes it started, e.g. the app under `dotnet run`
+    set -m
+    daemon &
+    PID=$!
+    while [ ! -f /tmp/checkpoint.hold ] && kill -0 $PID 2>/dev/null; do sleep 0.5; done
+    if [ ! -f /tmp/checkpoint.hold ]; then
+        wait $PID
+        exit $?
+    fi
+    kill -TERM -- -$PID
+    wait $PID
+    for _ in $(seq 120); do
+        kill -0 -- -$PID 2>/dev/null || break
+        sleep 0.5
+    done
+    # whatever ignored the request to stop must not write during the copy
+    kill -KILL -- -$PID 2>/dev/null
+    set +m
+    echo stopped > /tmp/checkpoint.stopped
+    while [ ! -f /tmp/checkpoint.resume ]; do sleep 0.5; done
+fi
+daemon
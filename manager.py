@@ -2,7 +2,9 @@ from traceback import print_exception
 from manager.engine.joinmarket_engine import JoinmarketEngine
 from manager.engine.wasabi_engine import WasabiEngine
 from manager.engine.engine_base import EngineBase
+from manager.transport import transport
 import manager.commands.genscen
+import manager.commands.multirun
 import sys
 import argparse
 
@@ -26,10 +28,13 @@ def run():
         print(f"Terminating exception: {e}", file=sys.stderr)
         print_exception(e)
     finally:
+        engine.stop_payments()
         engine.stop_coinjoins()
         if not args.no_logs:
             engine.store_logs()
         driver.cleanup(args.image_prefix)
+        stats = transport.stats()
+        print(f"RPC connections: {stats['opened']} opened, {stats['reused']} reused")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run coinjoin simulation setup")
@@ -102,6 +107,60 @@ if __name__ == "__main__":
     run_subparser.add_argument("--proxy", type=str, default="")
     run_subparser.add_argument("--namespace", type=str, default="coinjoin")
     run_subparser.add_argument("--reuse-namespace", action="store_true", default=False)
+    run_subparser.add_argument(
+        "--name-prefix", type=str, default="", help="prefix of container names, to run next to other simulations"
+    )
+    run_subparser.add_argument(
+        "--port-offset", type=int, default=0, help="offset added to all published ports"
+    )
+    run_subparser.add_argument(
+        "--compress-logs", action="store_true", default=False, help="gzip downloaded log files"
+    )
+    run_subparser.add_argument(
+        "--btc-node-snapshot",
+        action="store_true",
+        default=False,
+        help="start btc-node from the regtest chain snapshot baked into its image",
+    )
+    run_subparser.add_argument(
+        "--wallets-per-container",
+        type=int,
+        default=1,
+        help="number of wallets sharing one client container (wasabi 2.0.4 and newer, joinmarket)",
+    )
+    run_subparser.add_argument(
+        "--gateway", action="store_true", default=False, help="reach clients through a single rpc-gateway container"
+    )
+    run_subparser.add_argument(
+        "--gateway-allow",
+        type=str,
+        default="",
+        help="space-separated addresses or subnets besides private ones allowed to use the rpc-gateway",
+    )
+    run_subparser.add_argument(
+        "--distributor-utxos",
+        type=int,
+        default=10,
+        help="number of coins the distributor is funded with (more coins pay more invoices in parallel)",
+    )
+    run_subparser.add_argument(
+        "--direct-funding",
+        action="store_true",
+        default=False,
+        help="pay invoices from the btc-node wallet in large batches instead of through the distributor",
+    )
+    run_subparser.add_argument(
+        "--prefetch-addresses",
+        action="store_true",
+        default=False,
+        help="derive invoice addresses of each client as soon as it starts",
+    )
+    run_subparser.add_argument(
+        "--checkpoint",
+        action="store_true",
+        default=False,
+        help="save the funded world after the first run of a scenario and restore it on later runs",
+    )
 
     clean_subparser = subparsers.add_parser("clean", help="clean up")
     clean_subparser.add_argument("--namespace", type=str, default="coinjoin")
@@ -109,6 +168,9 @@ if __name__ == "__main__":
         "--reuse-namespace", action="store_true", default=False
     )
     clean_subparser.add_argument("--proxy", type=str, default="")
+    clean_subparser.add_argument(
+        "--name-prefix", type=str, default="", help="prefix of container names of the simulation to clean up"
+    )
     clean_subparser.add_argument(
         "--image-prefix", type=str, default="", help="image prefix"
     )
@@ -116,21 +178,36 @@ if __name__ == "__main__":
     genscen_subparser = subparsers.add_parser("genscen", help="generate scenario file")
     manager.commands.genscen.setup_parser(genscen_subparser)
 
+    multirun_subparser = subparsers.add_parser("multirun", help="run several simulations at once")
+    manager.commands.multirun.setup_parser(multirun_subparser)
+
+    # options of `run` read while setting up the driver and engine for the other commands
+    parser.set_defaults(name_prefix="", port_offset=0, gateway=False, btc_node_snapshot=False)
+
     args = parser.parse_args()
 
     if args.command == "genscen":
         manager.commands.genscen.handler(args)
         exit(0)
 
+    if args.command == "multirun":
+        manager.commands.multirun.handler(args)
+        exit(0)
+
     match args.driver:
         case "docker":
             from manager.driver.docker import DockerDriver
 
-            driver = DockerDriver("coinjoin")
-            driver = DockerDriver(args.namespace)
+            driver = DockerDriver(
+                args.namespace, args.name_prefix, args.port_offset
+            )
         case "podman":
             from manager.driver.podman import PodmanDriver
 
+            if args.gateway:
+                # podman containers share no network with name resolution the gateway could use
+                print("The rpc-gateway (--gateway) is not supported with the podman driver")
+                exit(1)
             driver = PodmanDriver()
         case "kubernetes":
             from manager.driver.kubernetes import KubernetesDriver
@@ -1,8 +1,17 @@
 import requests
-import json
 from time import sleep
 
+from manager.chain_archive import ChainArchiver
+from manager.transport import transport, loads
+from manager.utils import backoff
+
 WALLET = "wallet"
+SATS_PER_BTC = 100_000_000
+
+
+def to_btc(sats):
+    """Format an amount in satoshis as an exact BTC amount for the RPC."""
+    return f"{sats // SATS_PER_BTC}.{sats % SATS_PER_BTC:08d}"
 
 
 class BtcNode:
@@ -11,23 +20,44 @@ class BtcNode:
         self.port = port
         self.internal_ip = internal_ip
         self.proxy = proxy
+        self.archiver: ChainArchiver | None = None
 
-    def _rpc(self, request, wallet=None):
+    def _rpc(self, request, wallet=None, timeout=5):
         request["jsonrpc"] = "1.0"
         request["id"] = "1"
         try:
-            response = requests.post(
+            response = transport.post(
                 f"http://{self.host}:{self.port}" + ("/wallet/" + WALLET if wallet else ""),
-                data=json.dumps(request),
+                request,
+                self.proxy,
                 auth=("user", "password"),
-                proxies=dict(http=self.proxy),
-                timeout=5,
+                timeout=timeout,
             )
         except requests.exceptions.Timeout:
             return "timeout"
-        if response.json()["error"] is not None:
-            raise Exception(response.json()["error"])
-        return response.json()["result"]
+        response = loads(response.content)
+        if response["error"] is not None:
+            raise Exception(response["error"])
+        return response["result"]
+
+    def _rpc_batch(self, batch, wallet=None, timeout=30):
+        """Send several requests as one JSON-RPC batch and return their results in order."""
+        batch = [{**request, "jsonrpc": "1.0", "id": idx} for idx, request in enumerate(batch)]
+        if not batch:
+            return []
+        response = transport.post(
+            f"http://{self.host}:{self.port}" + ("/wallet/" + WALLET if wallet else ""),
+            batch,
+            self.proxy,
+            auth=("user", "password"),
+            timeout=timeout,
+        )
+        results = [None] * len(batch)
+        for response in loads(response.content):
+            if response["error"] is not None:
+                raise Exception(response["error"])
+            results[response["id"]] = response["result"]
+        return results
 
     def get_block_count(self):
         request = {
@@ -50,6 +80,24 @@ class BtcNode:
         }
         return self._rpc(request)
 
+    def get_block_hashes(self, heights):
+        return self._rpc_batch({"method": "getblockhash", "params": [height]} for height in heights)
+
+    def get_blocks(self, block_hashes):
+        return self._rpc_batch({"method": "getblock", "params": [block_hash, 2]} for block_hash in block_hashes)
+
+    def start_archiver(self, path):
+        self.archiver = ChainArchiver(self, path)
+        self.archiver.start()
+
+    def stop_archiver(self):
+        """Stop following the chain and return the number of archived blocks."""
+        if self.archiver is None:
+            return 0
+        archived = self.archiver.stop()
+        self.archiver = None
+        return archived
+
     def mine_block(self, count=1):
         initial_block_count = self.get_block_count()
 
@@ -74,38 +122,64 @@ class BtcNode:
         }
         self._rpc(request, WALLET)
 
+    def fund_addresses(self, amounts, timeout=60):
+        """Pay {address: satoshis} in a single transaction and return its txid."""
+        request = {
+            "method": "sendmany",
+            "params": ["", {address: to_btc(amount) for address, amount in amounts.items()}],
+        }
+        return self._rpc(request, WALLET, timeout=timeout)
+
+    def estimate_smart_fee(self, blocks=6):
+        request = {
+            "method": "estimatesmartfee",
+            "params": [blocks],
+        }
+        return self._rpc(request).get("feerate")
+
+    def get_mempool_size(self):
+        request = {
+            "method": "getmempoolinfo",
+            "params": [],
+        }
+        return self._rpc(request)["size"]
+
+    def is_ready(self):
+        """Whether the chain is bootstrapped: mature coins, fee estimates and no pending fee-building transactions."""
+        return self.get_block_count() > 200 and self.estimate_smart_fee() is not None and self.get_mempool_size() == 0
+
     def wait_ready(self):
+        delays = backoff(0.1, 2.0)
         while True:
             try:
-                block_count = self.get_block_count()
-                if block_count > 200:
+                if self.is_ready():
                     break
             except Exception:
                 pass
-            sleep(0.1)
-
-        # wait for the fee-building transactions
-        sleep(20)
+            sleep(next(delays))
 
     def create_wallet(self, wallet):
         request = {
             "method": "createwallet",
-            "params": {"wallet_name": "jm_wallet", "descriptors": False},
+            "params": {"wallet_name": wallet, "descriptors": False, "load_on_startup": True},
         }
 
         request["jsonrpc"] = "2.0"
         request["id"] = "1"
         try:
-            response = requests.post(
+            response = transport.post(
                 f"http://{self.host}:{self.port}",
-                data=json.dumps(request),
+                request,
+                self.proxy,
                 auth=("user", "password"),
-                proxies=dict(http=self.proxy),
                 timeout=5,
             )
         except requests.exceptions.Timeout:
             print("timeout")
-        if response.json()["error"] is not None:
-            print(response.json())
-            raise Exception(response.json()["error"])
-        print(response.json())
+            raise
+        response = loads(response.content)
+        if response["error"] is not None:
+            print(response)
+            raise Exception(response["error"])
+        print(response)
+        return response["result"]
@@ -0,0 +1,74 @@
+"""Export of the simulated chain into a compressed NDJSON file."""
+
+from functools import partial
+from multiprocessing.pool import ThreadPool
+import gzip
+import os
+import sys
+import threading
+
+from manager import utils
+from manager.transport import dumps
+
+EXPORT_BATCH_SIZE = 25
+EXPORT_WORKERS = 4
+ARCHIVE_INTERVAL = 10
+
+
+def fetch_blocks(node, heights):
+    return node.get_blocks(node.get_block_hashes(heights))
+
+
+def export_blocks(node, path, start, stop, batch_size=EXPORT_BATCH_SIZE, workers=EXPORT_WORKERS):
+    """Append blocks at heights [start, stop) to `path`, one JSON document per line.
+
+    Batches are fetched concurrently but written in height order. Every call
+    appends a separate gzip member and syncs it to disk, so the file stays
+    readable as one stream even if the manager dies mid-run.
+    """
+    if start >= stop:
+        return 0
+    with ThreadPool(workers) as pool, open(path, "ab") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="ab") as f:
+            for blocks in pool.imap(partial(fetch_blocks, node), utils.batched(range(start, stop), batch_size)):
+                for block in blocks:
+                    f.write(dumps(block) + b"\n")
+        raw.flush()
+        os.fsync(raw.fileno())
+    return stop - start
+
+
+class ChainArchiver:
+    """Follows the chain tip in the background and archives new blocks."""
+
+    def __init__(self, node, path, interval=ARCHIVE_INTERVAL):
+        self.node = node
+        self.path = path
+        self.interval = interval
+        self.next_height = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Archiver exception: {e}", file=sys.stderr)
+
+    def flush(self):
+        """Archive all blocks up to the current tip and return the number of archived blocks."""
+        with self._lock:
+            tip = self.node.get_block_count()
+            if isinstance(tip, int):
+                self.next_height += export_blocks(self.node, self.path, self.next_height, tip + 1)
+            return self.next_height
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        return self.flush()
@@ -0,0 +1,178 @@
+import argparse
+import math
+import os
+import re
+import shlex
+import signal
+import subprocess
+import sys
+from dataclasses import dataclass
+from time import sleep, time
+
+from manager.engine.configuration import ScenarioConfig
+
+# published ports of a run start at most this far above their defaults
+# (client ports grow with the number of wallets)
+PORT_SPAN = 1000
+# highest default port plus one published port per wallet
+MAX_BASE_PORT = 37132
+POLL_INTERVAL = 1.0
+
+
+@dataclass
+class Simulation:
+    name: str
+    scenario: str
+    clients: int
+    namespace: str
+    prefix: str
+    port_offset: int
+    process: subprocess.Popen | None = None
+    started: float = 0.0
+
+
+def setup_parser(parser: argparse.ArgumentParser):
+    parser.add_argument("scenarios", nargs="+", help="scenario specification files")
+    parser.add_argument(
+        "--parallel", type=int, default=2, help="maximal number of simulations running at once"
+    )
+    parser.add_argument(
+        "--max-clients",
+        type=int,
+        default=0,
+        help="maximal number of clients of all running simulations, 0 for no limit",
+    )
+    parser.add_argument(
+        "--namespace", type=str, default="coinjoin", help="base namespace, simulation NAME runs in NAMESPACE-NAME"
+    )
+    parser.add_argument(
+        "--port-offset",
+        type=int,
+        default=PORT_SPAN,
+        help="offset of the published ports of the first simulation, later ones are shifted further",
+    )
+    parser.add_argument(
+        "--run-args", type=str, default="", help="options passed to every run, e.g. '--gateway --btc-node-snapshot'"
+    )
+    parser.add_argument(
+        "--out-dir", type=str, default="logs/multirun", help="directory for the output of each simulation"
+    )
+
+
+def prepare_simulations(args) -> list[Simulation]:
+    simulations = []
+    names = set()
+    port_offset = args.port_offset
+    for path in args.scenarios:
+        scenario = ScenarioConfig.from_json_config(path)
+        # names become container prefixes and kubernetes namespaces
+        name = re.sub(r"[^a-z0-9-]+", "-", scenario.name.lower()).strip("-") or "scenario"
+        base, suffix = name, 1
+        while name in names:
+            suffix += 1
+            name = f"{base}-{suffix}"
+        names.add(name)
+
+        clients = len(scenario.wallets)
+        if MAX_BASE_PORT + port_offset + clients > 65535:
+            print(f"- not enough ports for {name}, run fewer simulations or use --gateway in --run-args")
+            sys.exit(1)
+        simulations.append(
+            Simulation(
+                name=name,
+                scenario=path,
+                clients=clients,
+                namespace=f"{args.namespace}-{name}",
+                prefix=f"{name}-",
+                port_offset=port_offset,
+            )
+        )
+        port_offset += PORT_SPAN * math.ceil((clients + 1) / PORT_SPAN)
+    return simulations
+
+
+def command(args, simulation: Simulation):
+    return [
+        sys.executable,
+        os.path.abspath(sys.argv[0]),
+        "--engine",
+        args.engine,
+        "--driver",
+        args.driver,
+        *(["--no-logs"] if args.no_logs else []),
+        "run",
+        "--scenario",
+        simulation.scenario,
+        "--namespace",
+        simulation.namespace,
+        "--name-prefix",
+        simulation.prefix,
+        "--port-offset",
+        str(simulation.port_offset),
+        *shlex.split(args.run_args),
+    ]
+
+
+def start(args, simulation: Simulation):
+    output = open(os.path.join(args.out_dir, f"{simulation.name}.log"), "w")
+    # in its own session, a Ctrl+C reaches the run only once, forwarded by the handler
+    simulation.process = subprocess.Popen(
+        command(args, simulation), stdout=output, stderr=subprocess.STDOUT, start_new_session=True
+    )
+    output.close()
+    simulation.started = time()
+    print(
+        f"- started {simulation.name} ({simulation.clients} clients, namespace {simulation.namespace}, port offset {simulation.port_offset})"
+    )
+
+
+def handler(args):
+    print("Running simulations")
+    if args.driver not in ("docker", "kubernetes"):
+        print(f"- driver '{args.driver}' cannot isolate concurrent simulations")
+        sys.exit(1)
+
+    simulations = prepare_simulations(args)
+    os.makedirs(args.out_dir, exist_ok=True)
+    waiting = list(simulations)
+    running: list[Simulation] = []
+    results = {}
+
+    def fits(simulation):
+        if not running:
+            return True
+        if len(running) >= args.parallel:
+            return False
+        clients = sum(x.clients for x in running) + simulation.clients
+        return args.max_clients == 0 or clients <= args.max_clients
+
+    try:
+        while waiting or running:
+            # start in order, so a large simulation is not starved by smaller ones
+            while waiting and fits(waiting[0]):
+                simulation = waiting.pop(0)
+                start(args, simulation)
+                running.append(simulation)
+
+            sleep(POLL_INTERVAL)
+            for simulation in list(running):
+                code = simulation.process.poll()
+                if code is None:
+                    continue
+                running.remove(simulation)
+                results[simulation.name] = code
+                print(f"- finished {simulation.name} (exit code {code}, {time() - simulation.started:.0f} seconds)")
+    except KeyboardInterrupt:
+        print()
+        print("KeyboardInterrupt received, stopping running simulations")
+        # every run stores its logs and cleans up its own namespace
+        for simulation in running:
+            simulation.process.send_signal(signal.SIGINT)
+        for simulation in running:
+            results[simulation.name] = simulation.process.wait()
+
+    failed = [name for name, code in results.items() if code != 0]
+    print(f"- {len(results) - len(failed)} of {len(simulations)} simulations succeeded")
+    if failed:
+        print(f"- failed: {', '.join(failed)}")
+        sys.exit(1)
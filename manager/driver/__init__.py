@@ -1,14 +1,94 @@
 from abc import ABC, abstractmethod
 from multiprocessing.pool import ThreadPool
+import threading
+import weakref
+
+_handles_lock = threading.Lock()
+
+RUN_WORKERS = 32
+HEALTH_INTERVAL = 3
+HEALTH_TIMEOUT = 5
+
+
+def tcp_probe(*ports):
+    """Health check command that passes once something listens on all `ports`."""
+    return ["bash", "-c", " && ".join(f"exec 3<>/dev/tcp/127.0.0.1/{port}" for port in ports)]
+
+
+class Readiness:
+    """Readiness events of containers, set by a single health monitor.
+
+    The monitor is started on first use and runs `monitor(readiness)` in a
+    daemon thread, so all waiters share one event stream from the runtime.
+    """
+
+    def __init__(self, monitor):
+        self._monitor = monitor
+        self._thread = None
+        self._events: dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def event(self, name):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._monitor, args=(self,), daemon=True)
+                self._thread.start()
+            return self._events.setdefault(name, threading.Event())
+
+    def set(self, name):
+        with self._lock:
+            event = self._events.setdefault(name, threading.Event())
+        event.set()
+
+    def forget(self, name):
+        with self._lock:
+            self._events.pop(name, None)
 
 
 class Driver(ABC):
+    def clone(self):
+        """Return a new driver instance with its own API connections."""
+        return self
+
+    @staticmethod
+    def _close_client(client):
+        """Release the API connections of `client`, the connection of a driver instance."""
+        pass
+
+    def handle(self):
+        """Return a driver instance that is safe to use from the calling thread.
+
+        Each thread gets one instance. Its connections are closed once the
+        thread ends or, for threads still alive, by `close_handles`.
+        """
+        if threading.current_thread() is threading.main_thread():
+            return self
+        with _handles_lock:
+            if "_handles" not in self.__dict__:
+                self._handles = threading.local()
+                self._clones = weakref.WeakSet()
+        driver = getattr(self._handles, "driver", None)
+        if driver is None:
+            driver = self._handles.driver = self.clone()
+            if driver is not self:
+                weakref.finalize(driver, self._close_client, driver.client)
+                with _handles_lock:
+                    self._clones.add(driver)
+        return driver
+
+    def close_handles(self):
+        """Close the connections of driver instances handed out to threads."""
+        with _handles_lock:
+            clones = list(self.__dict__.get("_clones", ()))
+        for driver in clones:
+            self._close_client(driver.client)
+
     @abstractmethod
     def has_image(self, name):
         pass
 
     @abstractmethod
-    def build(self, name, path):
+    def build(self, name, path, buildargs=None, dockerfile=None):
         pass
 
     @abstractmethod
@@ -25,9 +105,34 @@ class Driver(ABC):
         skip_ip=False,
         cpu=0.1,
         memory=768,
+        healthcheck=None,
     ):
         pass
 
+    def wait_healthy(self, name, timeout=None):
+        """Block until the health check of container `name` passes.
+
+        Returns False on timeout. Drivers that cannot observe health checks
+        return True right away and leave readiness to the caller.
+        """
+        return True
+
+    def run_many(self, specs, workers=RUN_WORKERS):
+        """Start the containers described by `specs`, keyword arguments of `run`.
+
+        Returns `(ip, ports)` for each spec in order, or the exception that
+        prevented the container from starting.
+        """
+
+        def run(spec):
+            try:
+                return self.run(**spec)
+            except Exception as e:
+                return e
+
+        with ThreadPool(workers) as pool:
+            return pool.map(run, specs)
+
     @abstractmethod
     def stop(self, name):
         pass
@@ -37,11 +142,17 @@ class Driver(ABC):
             p.map(lambda x: self.stop(x), names)
 
     @abstractmethod
-    def download(self, name, src_path, dst_path):
+    def download(self, name, src_path, dst_path, compress=False):
         pass
 
     @abstractmethod
     def peek(self, name, path):
+        """Return the content of the file at `path`, raise FileNotFoundError if there is none."""
+        pass
+
+    @abstractmethod
+    def peek_from(self, name, path, offset=0):
+        """Return the bytes of the file at `path` starting at `offset`."""
         pass
 
     @abstractmethod
@@ -51,3 +162,21 @@ class Driver(ABC):
     @abstractmethod
     def cleanup(self, image_prefix=""):
         pass
+
+
+class FileFollower:
+    """Follows an append-only file inside a container.
+
+    Only the bytes appended since the previous read are transferred.
+    """
+
+    def __init__(self, driver, name, path):
+        self.driver = driver
+        self.name = name
+        self.path = path
+        self.offset = 0
+
+    def read(self):
+        data = self.driver.peek_from(self.name, self.path, self.offset)
+        self.offset += len(data)
+        return data
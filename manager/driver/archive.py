@@ -0,0 +1,67 @@
+"""Streaming extraction of tar archives received from containers."""
+
+import gzip
+import io
+import os
+import shutil
+import tarfile
+
+CHUNK_SIZE = 1024 * 1024
+
+# reject absolute paths and links escaping the destination where supported
+EXTRACT_OPTIONS = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+
+
+class ChunkReader(io.RawIOBase):
+    """Readable file object over an iterator of byte chunks."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._chunk = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._chunk:
+            try:
+                self._chunk = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+
+def open_stream(chunks, mode="r|"):
+    return tarfile.open(fileobj=io.BufferedReader(ChunkReader(chunks), CHUNK_SIZE), mode=mode)
+
+
+def extract_stream(chunks, dst_path, mode="r|", compress=False):
+    """Extract a tar stream entry by entry as its chunks arrive.
+
+    With `compress`, regular files are written gzipped as `<name>.gz`.
+    """
+    root = os.path.realpath(dst_path)
+    with open_stream(chunks, mode) as tar:
+        for member in tar:
+            if not (compress and member.isfile()):
+                tar.extract(member, dst_path, **EXTRACT_OPTIONS)
+                continue
+            target = os.path.realpath(os.path.join(root, member.name + ".gz"))
+            if os.path.commonpath([root, target]) != root:
+                raise Exception(f"{member.name} is outside the destination")
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with tar.extractfile(member) as src, gzip.open(target, "wb") as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+
+def read_member(chunks, name, mode="r|"):
+    """Return the content of the archive member called `name`."""
+    with open_stream(chunks, mode) as tar:
+        for member in tar:
+            if member.isfile() and os.path.basename(member.name) == name:
+                with tar.extractfile(member) as f:
+                    return f.read()
+    raise FileNotFoundError(name)
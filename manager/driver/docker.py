@@ -2,21 +2,52 @@ from functools import cached_property
 from io import BytesIO
 import os
 import tarfile
+from time import sleep, time
 
 from docker.models.containers import Container
-from . import Driver
+from . import Driver, Readiness, RUN_WORKERS, HEALTH_INTERVAL, HEALTH_TIMEOUT
+from .archive import CHUNK_SIZE, extract_stream, read_member
 import docker
 
+# containers are labelled with the namespace (network) of their run
+NAMESPACE_LABEL = "coinjoin.namespace"
+
 
 class DockerDriver(Driver):
-    def __init__(self, namespace="coinjoin"):
-        self.client: docker.DockerClient = docker.from_env()
+    """Runs containers on one bridge network named after the namespace.
+
+    Container names are global on a Docker host, so concurrent runs set a
+    `prefix` for the names of their containers, which stay reachable by
+    their plain names on the run's network, and a `port_offset` for their
+    published ports.
+    """
+
+    def __init__(self, namespace="coinjoin", prefix="", port_offset=0):
+        # sized for concurrent container creation in run_many
+        self.client: docker.DockerClient = docker.from_env(max_pool_size=RUN_WORKERS)
         self._namespace = namespace
+        self.prefix = prefix
+        self.port_offset = port_offset
+        self.readiness = Readiness(self._watch_health)
+
+    def clone(self):
+        driver = DockerDriver(self._namespace, self.prefix, self.port_offset)
+        driver.readiness = self.readiness
+        if "network" in self.__dict__:
+            driver.network = self.network
+        return driver
+
+    @staticmethod
+    def _close_client(client):
+        client.close()
 
     @cached_property
     def network(self):
         return self.client.networks.create(self._namespace, driver="bridge")
 
+    def _container(self, name):
+        return self.client.containers.get(self.prefix + name)
+
     def has_image(self, name):
         try:
             self.client.images.get(name)
@@ -24,8 +55,10 @@ class DockerDriver(Driver):
         except docker.errors.ImageNotFound:
             return False
 
-    def build(self, name, path):
-        self.client.images.build(path=path, tag=name, rm=True, nocache=True)
+    def build(self, name, path, buildargs=None, dockerfile=None):
+        self.client.images.build(
+            path=path, tag=name, rm=True, nocache=True, buildargs=buildargs, dockerfile=dockerfile
+        )
 
     def pull(self, name):
         self.client.images.pull(name)
@@ -39,59 +72,122 @@ class DockerDriver(Driver):
         skip_ip=False,
         cpu=0.1,
         memory=768,
+        healthcheck=None,
     ):
-        self.client.containers.run(
+        self.readiness.forget(name)
+        ports = {port: host_port + self.port_offset for port, host_port in (ports or {}).items()}
+        container = self.client.containers.create(
             image,
             detach=True,
             auto_remove=True,
-            name=name,
+            name=self.prefix + name,
             hostname=name,
             network=self.network.id,
-            ports=ports or {},
+            ports=ports,
             environment=env or {},
+            healthcheck=self._healthcheck(healthcheck),
+            labels={NAMESPACE_LABEL: self._namespace},
         )
+        if self.prefix:
+            # other containers of the run reach it by its plain name
+            self.network.disconnect(container)
+            self.network.connect(container, aliases=[name])
+        container.start()
         return "", ports
 
+    @staticmethod
+    def _healthcheck(command):
+        if command is None:
+            return None
+        return {
+            "test": ["CMD", *command],
+            "interval": HEALTH_INTERVAL * 1_000_000_000,
+            "timeout": HEALTH_TIMEOUT * 1_000_000_000,
+            "retries": 3,
+        }
+
+    def _watch_health(self, readiness):
+        client = docker.from_env()
+        since = int(time())
+        while True:
+            try:
+                for event in client.events(
+                    since=since,
+                    decode=True,
+                    filters={
+                        "type": "container",
+                        "event": "health_status",
+                        "label": f"{NAMESPACE_LABEL}={self._namespace}",
+                    },
+                ):
+                    since = event.get("time", since)
+                    if event.get("status", "").endswith(": healthy"):
+                        readiness.set(event["Actor"]["Attributes"]["name"].removeprefix(self.prefix))
+            except Exception as e:
+                print(f"- health event stream failed ({e})")
+                sleep(1)
+
+    def wait_healthy(self, name, timeout=None):
+        event = self.readiness.event(name)
+        if not event.is_set():
+            # the container may have turned healthy before the monitor started
+            try:
+                state = self.handle()._container(name).attrs["State"]
+            except docker.errors.NotFound:
+                return False
+            if "Health" not in state:
+                return True
+            if state["Health"].get("Status") == "healthy":
+                event.set()
+        return event.wait(timeout)
+
     def stop(self, name):
+        self.readiness.forget(name)
         try:
-            self.client.containers.get(name).stop()
+            self._container(name).stop()
             print(f"- stopped {name}")
         except docker.errors.NotFound:
             pass
 
-    def download(self, name, src_path, dst_path):
+    def download(self, name, src_path, dst_path, compress=False):
         try:
-            stream, _ = self.client.containers.get(name).get_archive(src_path)
-
-            fo = BytesIO()
-            for d in stream:
-                fo.write(d)
-            fo.seek(0)
-            with tarfile.open(fileobj=fo) as tar:
-                tar.extractall(dst_path)
+            stream, _ = self._container(name).get_archive(src_path, chunk_size=CHUNK_SIZE)
+            extract_stream(stream, dst_path, compress=compress)
         except:
             pass
 
     def peek(self, name, path):
-        stream, _ = self.client.containers.get(name).get_archive(path)
+        container = self._container(name)
+        try:
+            stream, _ = container.get_archive(path, chunk_size=CHUNK_SIZE)
+        except docker.errors.NotFound:
+            raise FileNotFoundError(path)
+        return read_member(stream, os.path.basename(path)).decode()
 
-        fo = BytesIO()
-        for d in stream:
-            fo.write(d)
-        fo.seek(0)
-        with tarfile.open(fileobj=fo) as tar:
-            return tar.extractfile(os.path.basename(path)).read().decode()
+    def peek_from(self, name, path, offset=0):
+        exit_code, output = self._container(name).exec_run(
+            ["tail", "-c", f"+{offset + 1}", path]
+        )
+        if exit_code != 0:
+            raise Exception(output.decode(errors="replace").strip())
+        return output
 
     def upload(self, name, src_path, dst_path):
         fo = BytesIO()
         with tarfile.open(fileobj=fo, mode="w") as tar:
             tar.add(src_path, os.path.basename(dst_path))
         fo.seek(0)
-        self.client.containers.get(name).put_archive(os.path.dirname(dst_path), fo)
+        self._container(name).put_archive(os.path.dirname(dst_path), fo)
 
     def cleanup(self, image_prefix=""):
+        self.close_handles()
         containers = []
         for container in self.client.containers.list():
+            # only containers of this run; unlabelled ones predate labels
+            if container.labels.get(NAMESPACE_LABEL, None if self.prefix else self._namespace) != self._namespace:
+                continue
+            if not container.name.startswith(self.prefix):
+                continue
             if any(
                 x in container.attrs["Config"]["Image"]
                 for x in (
@@ -103,12 +199,13 @@ class DockerDriver(Driver):
                     "wasabi-client-distributor",
                     "wasabi-coordinator",
                     "joinmarket-client-server",
+                    "rpc-gateway",
                 )
             ):
                 containers.append(container)
 
-        self.stop_many(map(lambda x: x.name, containers))
-        networks = self.client.networks.list(self._namespace)
-        if networks:
-            for network in networks:
+        self.stop_many(map(lambda x: x.name.removeprefix(self.prefix), containers))
+        # the name filter also matches namespaces that start with this one
+        for network in self.client.networks.list(self._namespace):
+            if network.name == self._namespace:
                 network.remove()
@@ -2,12 +2,27 @@ from functools import cached_property
 from io import BytesIO
 import os
 import tarfile
-from time import sleep
-from . import Driver
+from multiprocessing.pool import ThreadPool
+from time import sleep, time
+import uuid
+from . import Driver, Readiness, RUN_WORKERS, HEALTH_INTERVAL, HEALTH_TIMEOUT
+from .archive import extract_stream
 from kubernetes import client, config
+from kubernetes.watch import Watch
 from kubernetes.stream import stream
+from kubernetes.stream.ws_client import ERROR_CHANNEL, STDOUT_CHANNEL
+from websocket import ABNF, WebSocketConnectionClosedException
+import yaml
 from kubernetes.client.exceptions import ApiException
 
+BATCH_LABEL = "coinjoin-batch"
+POD_START_TIMEOUT = 600
+POD_DELETE_TIMEOUT = 120
+POD_DELETE_INTERVAL = 2
+
+
+class CommandFailed(Exception):
+    """A command executed in a pod exited with a non-zero code."""
 
 class KubernetesDriver(Driver):
     def __init__(self, namespace="coinjoin", reuse_namespace=False):
@@ -15,6 +30,22 @@ class KubernetesDriver(Driver):
         self.client = client.CoreV1Api()
         self._namespace = namespace
         self.reuse_namespace = reuse_namespace
+        self.readiness = Readiness(self._watch_health)
+
+    def clone(self):
+        # the exec stream swaps the request method of its ApiClient, so every
+        # thread needs its own client
+        driver = KubernetesDriver(self._namespace, reuse_namespace=True)
+        driver.reuse_namespace = self.reuse_namespace
+        driver.readiness = self.readiness
+        if "namespace" in self.__dict__:
+            driver.namespace = self.namespace
+        return driver
+
+    @staticmethod
+    def _close_client(client):
+        client.api_client.rest_client.pool_manager.clear()
+        client.api_client.close()
 
     @cached_property
     def namespace(self):
@@ -30,31 +61,17 @@ class KubernetesDriver(Driver):
     def has_image(self, name):
         return True
 
-    def build(self, name, path):
+    def build(self, name, path, buildargs=None, dockerfile=None):
         pass
 
     def pull(self, name):
         pass
 
-    def run(
-        self,
-        name,
-        image,
-        env=None,
-        ports=None,
-        skip_ip=False,
-        cpu=0.1,
-        memory=768,
-    ):
-        if ports is None:
-            ports = {}
-        if env is None:
-            env = {}
-
-        pod_manifest = {
+    def _pod_manifest(self, name, image, env, ports, cpu, memory, labels=None, healthcheck=None):
+        manifest = {
             "apiVersion": "v1",
             "kind": "Pod",
-            "metadata": {"name": name, "labels": {"app": name}},
+            "metadata": {"name": name, "labels": {"app": name, **(labels or {})}},
             "spec": {
                 "restartPolicy": "Never",
                 "containers": [
@@ -99,20 +116,16 @@ class KubernetesDriver(Driver):
                 ],
             },
         }
+        if healthcheck is not None:
+            manifest["spec"]["containers"][0]["readinessProbe"] = {
+                "exec": {"command": healthcheck},
+                "periodSeconds": HEALTH_INTERVAL,
+                "timeoutSeconds": HEALTH_TIMEOUT,
+            }
+        return manifest
 
-        resp = self.client.create_namespaced_pod(
-            body=pod_manifest, namespace=self.namespace
-        )
-
-        pod_ip = None
-        if not skip_ip:
-            while pod_ip is None:
-                pod_ip = self.client.read_namespaced_pod_status(
-                    name=name, namespace=self.namespace
-                ).status.pod_ip
-                sleep(1)
-
-        service_manifest = {
+    def _service_manifest(self, name, ports):
+        return {
             "apiVersion": "v1",
             "kind": "Service",
             "metadata": {"name": f"{name}-service"},
@@ -131,15 +144,128 @@ class KubernetesDriver(Driver):
             },
         }
 
+    def _create_service(self, name, ports):
+        if not ports:
+            # containers reached through the gateway need no service
+            return {}
         resp = self.client.create_namespaced_service(
-            body=service_manifest, namespace=self.namespace
+            body=self._service_manifest(name, ports), namespace=self.namespace
         )
-        port_mapping = dict(
-            map(lambda x: (x.target_port, x.node_port), resp.spec.ports)
+        return dict(map(lambda x: (x.target_port, x.node_port), resp.spec.ports))
+
+    def run(
+        self,
+        name,
+        image,
+        env=None,
+        ports=None,
+        skip_ip=False,
+        cpu=0.1,
+        memory=768,
+        healthcheck=None,
+    ):
+        if ports is None:
+            ports = {}
+        if env is None:
+            env = {}
+
+        self.readiness.forget(name)
+        self.client.create_namespaced_pod(
+            body=self._pod_manifest(name, image, env, ports, cpu, memory, healthcheck=healthcheck),
+            namespace=self.namespace,
         )
-        return pod_ip or "", port_mapping
+
+        pod_ip = None
+        if not skip_ip:
+            while pod_ip is None:
+                pod_ip = self.client.read_namespaced_pod_status(
+                    name=name, namespace=self.namespace
+                ).status.pod_ip
+                sleep(1)
+
+        return pod_ip or "", self._create_service(name, ports)
+
+    def run_many(self, specs, workers=RUN_WORKERS):
+        """Create all pods at once and collect their IPs from a single watch stream."""
+        batch = uuid.uuid4().hex[:12]
+        self.namespace  # create the namespace before the workers race for it
+
+        def create_pod(spec):
+            self.readiness.forget(spec["name"])
+            try:
+                self.client.create_namespaced_pod(
+                    body=self._pod_manifest(
+                        spec["name"],
+                        spec["image"],
+                        spec.get("env") or {},
+                        spec.get("ports") or {},
+                        spec.get("cpu", 0.1),
+                        spec.get("memory", 768),
+                        labels={BATCH_LABEL: batch},
+                        healthcheck=spec.get("healthcheck"),
+                    ),
+                    namespace=self.namespace,
+                )
+            except Exception as e:
+                return e
+
+        with ThreadPool(workers) as pool:
+            created = pool.map(create_pod, specs)
+
+            pod_ips = {}
+            waiting = {
+                spec["name"]
+                for spec, error in zip(specs, created)
+                if error is None and not spec.get("skip_ip", False)
+            }
+            if waiting:
+                watch = Watch()
+                for event in watch.stream(
+                    self.client.list_namespaced_pod,
+                    namespace=self.namespace,
+                    label_selector=f"{BATCH_LABEL}={batch}",
+                    timeout_seconds=POD_START_TIMEOUT,
+                ):
+                    pod = event["object"]
+                    if pod.metadata.name in waiting and pod.status.pod_ip:
+                        pod_ips[pod.metadata.name] = pod.status.pod_ip
+                        waiting.discard(pod.metadata.name)
+                    if not waiting:
+                        watch.stop()
+
+            def create_service(spec, error):
+                if error is not None:
+                    return error
+                if spec["name"] in waiting:
+                    return Exception(f"pod {spec['name']} got no IP in {POD_START_TIMEOUT} seconds")
+                try:
+                    return pod_ips.get(spec["name"], ""), self._create_service(spec["name"], spec.get("ports") or {})
+                except Exception as e:
+                    return e
+
+            return pool.starmap(create_service, zip(specs, created))
+
+    def _watch_health(self, readiness):
+        # a separate ApiClient, the watch holds its connection open
+        api = client.CoreV1Api(client.ApiClient())
+        while True:
+            try:
+                for event in Watch().stream(api.list_namespaced_pod, namespace=self.namespace):
+                    pod = event["object"]
+                    if event["type"] != "DELETED" and any(
+                        condition.type == "Ready" and condition.status == "True"
+                        for condition in pod.status.conditions or []
+                    ):
+                        readiness.set(pod.metadata.name)
+            except Exception as e:
+                print(f"- pod watch failed ({e})")
+                sleep(1)
+
+    def wait_healthy(self, name, timeout=None):
+        return self.readiness.event(name).wait(timeout)
 
     def stop(self, name):
+        self.readiness.forget(name)
         try:
             self.client.delete_namespaced_pod(name=name, namespace=self.namespace)
             self.client.delete_namespaced_service(
@@ -147,55 +273,73 @@ class KubernetesDriver(Driver):
             )
         except:
             pass
+        # a pod of the same name cannot be created until the old one is gone,
+        # which takes up to its termination grace period
+        start = time()
+        while time() - start < POD_DELETE_TIMEOUT:
+            try:
+                self.client.read_namespaced_pod(name=name, namespace=self.namespace)
+            except ApiException as e:
+                if e.status == 404:
+                    return
+            sleep(POD_DELETE_INTERVAL)
 
-    def download(self, name, src_path, dst_path):
-        if src_path[-1] == "/":
-            src_path = src_path[:-1]
-        src_parent, src_target = os.path.split(src_path)
-        exec_command = ["tar", "cf", "-", "-C", src_parent, src_target]
+    def exec_stream(self, name, command):
+        """Yield raw stdout chunks of `command` executed in the pod.
+
+        Frames are read from the websocket directly because the stream
+        client decodes every frame as UTF-8, which corrupts binary output.
+        """
         resp = stream(
             self.client.connect_get_namespaced_pod_exec,
             name,
             self.namespace,
-            command=exec_command,
+            command=command,
             stderr=True,
-            stdin=True,
+            stdin=False,
             stdout=True,
             tty=False,
             _preload_content=False,
         )
+        status = None
+        try:
+            while resp.is_open():
+                try:
+                    op_code, frame = resp.sock.recv_data_frame(True)
+                except WebSocketConnectionClosedException:
+                    break
+                if op_code == ABNF.OPCODE_CLOSE:
+                    break
+                if op_code not in (ABNF.OPCODE_BINARY, ABNF.OPCODE_TEXT) or len(frame.data) < 2:
+                    continue
+                channel, data = frame.data[0], frame.data[1:]
+                if channel == STDOUT_CHANNEL:
+                    yield data
+                elif channel == ERROR_CHANNEL:
+                    status = yaml.safe_load(data)
+        finally:
+            resp.close()
+        if status is not None and status.get("status") != "Success":
+            if status.get("reason") == "NonZeroExitCode":
+                raise CommandFailed(f"{command[0]} failed in {name}: {status.get('message')}")
+            raise Exception(f"{command[0]} failed in {name}: {status.get('message')}")
 
-        fo = BytesIO()
-        while resp.is_open():
-            resp.update(timeout=1)
-            if resp.peek_stdout():
-                fo.write(resp.read_stdout().encode())
-        fo.seek(0)
-        with tarfile.open(fileobj=fo) as tar:
-            tar.extractall(dst_path)
-        resp.close()
+    def download(self, name, src_path, dst_path, compress=False):
+        if src_path[-1] == "/":
+            src_path = src_path[:-1]
+        src_parent, src_target = os.path.split(src_path)
+        # compress inside the pod, the transfer is the slow part
+        exec_command = ["tar", "czf", "-", "-C", src_parent, src_target]
+        extract_stream(self.exec_stream(name, exec_command), dst_path, mode="r|gz", compress=compress)
 
     def peek(self, name, path):
-        exec_command = ["cat", path]
-        resp = stream(
-            self.client.connect_get_namespaced_pod_exec,
-            name,
-            self.namespace,
-            command=exec_command,
-            stderr=True,
-            stdin=True,
-            stdout=True,
-            tty=False,
-            _preload_content=False,
-        )
+        try:
+            return b"".join(self.exec_stream(name, ["cat", path])).decode()
+        except CommandFailed:
+            raise FileNotFoundError(path)
 
-        output = ""
-        while resp.is_open():
-            resp.update(timeout=1)
-            if resp.peek_stdout():
-                output += resp.read_stdout()
-        resp.close()
-        return output
+    def peek_from(self, name, path, offset=0):
+        return b"".join(self.exec_stream(name, ["tail", "-c", f"+{offset + 1}", path]))
 
     def upload(self, name, src_path, dst_path):
         buf = BytesIO()
@@ -230,11 +374,12 @@ class KubernetesDriver(Driver):
         resp.close()
 
     def cleanup(self, image_prefix=""):
+        self.close_handles()
         pods = self.client.list_namespaced_pod(namespace=self._namespace)
         for pod in pods.items:
             if any(
                 x in pod.metadata.name
-                for x in ("irc-server", "btc-node", "wasabi-backend", "wasabi-client", "joinmarket-client-server")
+                for x in ("irc-server", "btc-node", "wasabi-backend", "wasabi-client", "joinmarket-client-server", "rpc-gateway")
             ):
                 try:
                     self.client.delete_namespaced_pod(
@@ -246,7 +391,7 @@ class KubernetesDriver(Driver):
         for service in services.items:
             if any(
                 x in service.metadata.name
-                for x in ("irc-server", "btc-node", "wasabi-backend", "wasabi-client", "joinmarket-client-server")
+                for x in ("irc-server", "btc-node", "wasabi-backend", "wasabi-client", "joinmarket-client-server", "rpc-gateway")
             ):
                 try:
                     self.client.delete_namespaced_service(
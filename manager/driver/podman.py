@@ -2,6 +2,7 @@ from io import BytesIO
 import os
 import tarfile
 from . import Driver
+from .archive import CHUNK_SIZE, extract_stream, read_member
 import podman
 import docker
 
@@ -10,6 +11,13 @@ class PodmanDriver(Driver):
     def __init__(self):
         self.client = podman.PodmanClient()
 
+    def clone(self):
+        return PodmanDriver()
+
+    @staticmethod
+    def _close_client(client):
+        client.close()
+
     def has_image(self, name):
         try:
             docker.from_env().images.get(name)
@@ -17,8 +25,10 @@ class PodmanDriver(Driver):
         except docker.errors.ImageNotFound:
             return False
 
-    def build(self, name, path):
-        docker.from_env().images.build(path=path, tag=name, rm=True, nocache=True)
+    def build(self, name, path, buildargs=None, dockerfile=None):
+        docker.from_env().images.build(
+            path=path, tag=name, rm=True, nocache=True, buildargs=buildargs, dockerfile=dockerfile
+        )
 
     def pull(self, name):
         docker.from_env().images.pull(name)
@@ -32,7 +42,9 @@ class PodmanDriver(Driver):
         skip_ip=False,
         cpu=0.1,
         memory=768,
+        healthcheck=None,
     ):
+        # health events are not observed here; readiness is left to the caller
         self.client.containers.run(
             image,
             detach=True,
@@ -51,30 +63,30 @@ class PodmanDriver(Driver):
         except docker.errors.NotFound:
             pass
 
-    def download(self, name, src_path, dst_path):
+    def download(self, name, src_path, dst_path, compress=False):
         try:
-            stream, _ = docker.from_env().containers.get(name).get_archive(src_path)
-
-            fo = BytesIO()
-            for d in stream:
-                fo.write(d)
-            fo.seek(0)
-            with tarfile.open(fileobj=fo) as tar:
-                tar.extractall(dst_path)
+            stream, _ = docker.from_env().containers.get(name).get_archive(src_path, chunk_size=CHUNK_SIZE)
+            extract_stream(stream, dst_path, compress=compress)
 
             print(f"- stored backend logs")
         except:
             print(f"- could not store backend logs")
 
     def peek(self, name, path):
-        stream, _ = docker.from_env().containers.get(name).get_archive(path)
+        container = docker.from_env().containers.get(name)
+        try:
+            stream, _ = container.get_archive(path, chunk_size=CHUNK_SIZE)
+        except docker.errors.NotFound:
+            raise FileNotFoundError(path)
+        return read_member(stream, os.path.basename(path)).decode()
 
-        fo = BytesIO()
-        for d in stream:
-            fo.write(d)
-        fo.seek(0)
-        with tarfile.open(fileobj=fo) as tar:
-            return tar.extractfile(os.path.basename(path)).read().decode()
+    def peek_from(self, name, path, offset=0):
+        exit_code, output = docker.from_env().containers.get(name).exec_run(
+            ["tail", "-c", f"+{offset + 1}", path]
+        )
+        if exit_code != 0:
+            raise Exception(output.decode(errors="replace").strip())
+        return output
 
     def upload(self, name, src_path, dst_path):
         fo = BytesIO()
@@ -86,11 +98,12 @@ class PodmanDriver(Driver):
         )
 
     def cleanup(self, image_prefix=""):
+        self.close_handles()
         containers = []
         for container in docker.from_env().containers.list():
             if any(
                 x in container.attrs["Config"]["Image"]
-                for x in ("irc-server", "btc-node", "wasabi-backend", "wasabi-client", "joinmarket-client-server")
+                for x in ("irc-server", "btc-node", "wasabi-backend", "wasabi-client", "joinmarket-client-server", "rpc-gateway")
             ):
                 containers.append(container)
                 
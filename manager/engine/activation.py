@@ -0,0 +1,87 @@
+"""Compiled coinjoin activation timeline for scenario clients."""
+
+from bisect import bisect_right
+from collections import defaultdict
+
+
+class ActivationSchedule:
+    """Per-block and per-round activation timeline of clients.
+
+    A client's desired mixing state can only change at its delay, stop and
+    skip round boundaries. These are indexed up front, so an event only
+    re-evaluates the clients with a boundary in the crossed block or round
+    range, and only clients whose known state differs are reported.
+    """
+
+    def __init__(self, clients):
+        self.clients = {client.name: client for client in clients}
+        self.skip_rounds = {}
+        block_index = defaultdict(set)
+        round_index = defaultdict(set)
+        for client in clients:
+            skip_rounds = frozenset(getattr(client, "skip_rounds", None) or ())
+            self.skip_rounds[client.name] = skip_rounds
+            for block in (client.delay[0], client.stop[0]):
+                if block > 0:
+                    block_index[block].add(client.name)
+            for round in (client.delay[1], client.stop[1]):
+                if round > 0:
+                    round_index[round].add(client.name)
+            for round in skip_rounds:
+                round_index[round].add(client.name)
+                round_index[round + 1].add(client.name)
+
+        self.block_boundaries = sorted(block_index)
+        self.block_index = [block_index[block] for block in self.block_boundaries]
+        self.round_boundaries = sorted(round_index)
+        self.round_index = [round_index[round] for round in self.round_boundaries]
+
+        self.active: dict[str, bool] = {}
+        self.pending = set(self.clients)
+        self.block = 0
+        self.round = 0
+
+    def is_active(self, name, block, round):
+        client = self.clients[name]
+        if client.stop[0] > 0 and block >= client.stop[0]:
+            return False
+        if client.stop[1] > 0 and round >= client.stop[1]:
+            return False
+        if block < client.delay[0]:
+            return False
+        if round < client.delay[1]:
+            return False
+        if round in self.skip_rounds[name]:
+            return False
+        return True
+
+    @staticmethod
+    def _crossed(boundaries, index, old, new):
+        low, high = min(old, new), max(old, new)
+        crossed = set()
+        for names in index[bisect_right(boundaries, low) : bisect_right(boundaries, high)]:
+            crossed |= names
+        return crossed
+
+    def advance(self, block, round):
+        """Move the timeline to (block, round) and return clients to start and stop."""
+        candidates = self.pending
+        candidates |= self._crossed(self.block_boundaries, self.block_index, self.block, block)
+        candidates |= self._crossed(self.round_boundaries, self.round_index, self.round, round)
+        self.pending = set()
+        self.block, self.round = block, round
+
+        start, stop = [], []
+        for name in candidates:
+            active = self.is_active(name, block, round)
+            if self.active.get(name) != active:
+                (start if active else stop).append(self.clients[name])
+        return start, stop
+
+    def confirm(self, client, active):
+        self.active[client.name] = active
+
+    def invalidate(self, name):
+        """Forget the known state of a client so it is re-sent on the next event."""
+        self.active.pop(name, None)
+        self.pending.add(name)
@@ -0,0 +1,78 @@
+"""Adaptive limit on the number of clients starting at the same time."""
+
+from time import monotonic
+import os
+import threading
+
+
+def available_memory():
+    """Return the fraction of host memory available, or None if unknown."""
+    try:
+        with open("/proc/meminfo") as f:
+            info = dict(line.split(":", 1) for line in f)
+        total = int(info["MemTotal"].split()[0])
+        available = int(info["MemAvailable"].split()[0])
+    except (OSError, KeyError, ValueError):
+        return None
+    return available / total if total else None
+
+
+class AdmissionController:
+    """Caps how many clients may be starting at once.
+
+    The cap grows by one after every successful start faster than
+    `target_latency` and is halved, at most once per `cooldown` seconds,
+    when a start fails, is slow, or the host is short on CPU or memory.
+    While the host is under pressure only one client is admitted at a time.
+    """
+
+    def __init__(
+        self,
+        initial=8,
+        minimum=1,
+        maximum=64,
+        target_latency=60.0,
+        max_load=1.5,
+        min_memory=0.1,
+        cooldown=10.0,
+    ):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.max_load = max_load
+        self.min_memory = min_memory
+        self.cooldown = cooldown
+        self.starting = 0
+        self._decreased = 0.0
+        self._lock = threading.Lock()
+
+    def host_pressure(self):
+        try:
+            load = os.getloadavg()[0] / (os.cpu_count() or 1)
+        except OSError:
+            load = 0.0
+        memory = available_memory()
+        return load > self.max_load or (memory is not None and memory < self.min_memory)
+
+    def available(self):
+        """Return the number of clients that may be admitted now."""
+        with self._lock:
+            starting, limit = self.starting, self.limit
+        if self.host_pressure():
+            return 0 if starting else 1
+        return max(limit - starting, 0)
+
+    def admit(self, count=1):
+        with self._lock:
+            self.starting += count
+
+    def release(self, latency, success):
+        """Record a finished start attempt and adapt the cap."""
+        with self._lock:
+            self.starting -= 1
+            if success and latency < self.target_latency and not self.host_pressure():
+                self.limit = min(self.limit + 1, self.maximum)
+            elif monotonic() - self._decreased > self.cooldown:
+                self.limit = max(self.limit // 2, self.minimum)
+                self._decreased = monotonic()
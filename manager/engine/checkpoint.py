@@ -0,0 +1,134 @@
+"""Checkpoints of a funded simulation world."""
+
+from dataclasses import asdict
+import hashlib
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import uuid
+from time import sleep, time
+
+from manager.utils import backoff
+
+CHECKPOINT_DIR = "./checkpoints"
+# containers started with RESTORE_CHECKPOINT wait for the marker, then
+# extract the archive as their own user before starting their daemon
+ARCHIVE_PATH = "/tmp/checkpoint.tar"
+MARKER_PATH = "/tmp/checkpoint.restored"
+# containers started with SAVE_CHECKPOINT stop their daemon on the hold marker,
+# report it in the stopped file and start it again on the resume marker
+HOLD_PATH = "/tmp/checkpoint.hold"
+STOPPED_PATH = "/tmp/checkpoint.stopped"
+RESUME_PATH = "/tmp/checkpoint.resume"
+STOP_TIMEOUT = 120
+STATE_FILE = "state.json"
+
+
+def checkpoint_key(engine, scenario, **options):
+    """Hash of everything that determines the funded world of a scenario.
+
+    `options` are the run options that shape it, e.g. wallet packing.
+    """
+    data = {
+        "engine": engine,
+        "default_version": scenario.default_version,
+        "distributor_version": scenario.distributor_version,
+        "wallets": [asdict(wallet) for wallet in scenario.wallets],
+        **options,
+    }
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def upload_marker(driver, name, path):
+    with tempfile.NamedTemporaryFile() as marker:
+        driver.upload(name, marker.name, path)
+
+
+class Checkpoint:
+    """Container directories and engine state saved after the funding phase.
+
+    Every container is stored as one archive of its directories. A run saves
+    into its own staging directory, which is renamed to `path` once the state
+    file is written, so only complete checkpoints are restored and concurrent
+    runs of the same scenario do not mix their archives.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.staging = f"{path}.tmp-{uuid.uuid4().hex[:8]}"
+        self.state = None
+        if os.path.exists(os.path.join(self.path, STATE_FILE)):
+            with open(os.path.join(self.path, STATE_FILE)) as f:
+                self.state = json.load(f)
+
+    @property
+    def root(self):
+        """Directory read when restoring and written when saving."""
+        return self.path if self.exists else self.staging
+
+    @property
+    def exists(self):
+        return self.state is not None
+
+    def archive(self, name):
+        return os.path.join(self.root, "containers", f"{name}.tar")
+
+    def has_container(self, name):
+        return self.exists and name in self.state["containers"]
+
+    def save_container(self, driver, name, paths):
+        os.makedirs(os.path.dirname(self.archive(name)), exist_ok=True)
+        with tempfile.TemporaryDirectory() as tmp:
+            with tarfile.open(self.archive(name), "w") as tar:
+                for path in paths:
+                    path = path.rstrip("/")
+                    driver.download(name, path, tmp)
+                    local_path = os.path.join(tmp, os.path.basename(path))
+                    if not os.path.exists(local_path):
+                        raise Exception(f"could not download {path} from {name}")
+                    tar.add(local_path, arcname=path.lstrip("/"))
+                    shutil.rmtree(local_path)
+
+    def restore_container(self, driver, name):
+        driver.upload(name, self.archive(name), ARCHIVE_PATH)
+        upload_marker(driver, name, MARKER_PATH)
+
+    @staticmethod
+    def hold_container(driver, name, timeout=STOP_TIMEOUT):
+        """Stop the daemon of container `name` so its directories can be copied consistently."""
+        upload_marker(driver, name, HOLD_PATH)
+        start = time()
+        delays = backoff(0.5, 5.0)
+        while time() - start < timeout:
+            try:
+                if driver.peek(name, STOPPED_PATH).strip() == "stopped":
+                    return
+            except Exception:
+                pass
+            sleep(next(delays))
+        raise Exception(f"{name} did not stop for the checkpoint")
+
+    @staticmethod
+    def resume_container(driver, name):
+        upload_marker(driver, name, RESUME_PATH)
+
+    def save_state(self, state):
+        """Write the state and publish the staged checkpoint; returns False if another run published one first."""
+        os.makedirs(self.staging, exist_ok=True)
+        with open(os.path.join(self.staging, STATE_FILE), "w") as f:
+            json.dump(state, f, indent=2)
+        try:
+            os.rename(self.staging, self.path)
+        except OSError:
+            if not os.path.exists(os.path.join(self.path, STATE_FILE)):
+                raise
+            self.discard()
+            return False
+        self.state = state
+        return True
+
+    def discard(self):
+        """Remove the staging directory of an unfinished save."""
+        shutil.rmtree(self.staging, ignore_errors=True)
@@ -1,21 +1,106 @@
 from manager.btc_node import BtcNode
+from manager.chain_archive import export_blocks
+from manager.transport import dumps
 from manager import utils
 from manager.engine.configuration import ScenarioConfig, WalletConfig, FundConfig
-from time import sleep
+from manager.engine.admission import AdmissionController
+from manager.engine.payments import InvoiceQueue, PaymentPipeline
+from manager.engine.checkpoint import CHECKPOINT_DIR, Checkpoint, checkpoint_key
+from collections import defaultdict
+from functools import cached_property
+from time import sleep, monotonic
+import heapq
+import itertools
 import random
 import os
 import json
 import multiprocessing
 import multiprocessing.pool
-import math
+import queue
 import shutil
 import datetime
+import sys
 
 DISTRIBUTOR_UTXOS = 10
 BATCH_SIZE = 20
+# distributor batches being paid at the same time
+PAYMENT_CONCURRENCY = 4
+# seconds to wait for pending payments when the simulation ends
+PAYMENT_DRAIN_TIMEOUT = 60
+# outputs per node transaction in direct funding mode
+DIRECT_BATCH_SIZE = 1000
+LOG_WORKERS = 16
+# clients deriving invoice addresses at the same time
+ADDRESS_WORKERS = 32
+CLIENT_START_TIMEOUT = 120
+# mining 200 blocks and building fee estimates takes a few minutes
+BOOTSTRAP_TIMEOUT = 900
+START_ATTEMPTS = 4
+START_RETRY_DELAY = 10
+START_POLL_INTERVAL = 1.0
+GATEWAY_PORT = 8888
+# written by the btc-node run.sh once the chain is ready to be used
+BOOTSTRAP_MARKER = "/tmp/bootstrapped"
 BTC = 100_000_000
 
 
+class Scheduler:
+    """Turns polled values and timers into callbacks.
+
+    Watched sources are polled on their own interval and their handlers run
+    only when the observed value changes, so per-client work is driven by
+    block and round events instead of wall-clock ticks.
+    """
+
+    def __init__(self):
+        self._timers = []
+        self._sequence = itertools.count()
+        self._handlers = defaultdict(list)
+        self._values = {}
+
+    def on(self, event, callback):
+        self._handlers[event].append(callback)
+
+    def emit(self, event, value):
+        for callback in self._handlers[event]:
+            callback(value)
+
+    def every(self, interval, callback):
+        heapq.heappush(self._timers, (monotonic(), next(self._sequence), interval, callback))
+
+    def watch(self, event, poll, interval=1.0, retries=3):
+        def check():
+            delays = utils.backoff(0.2, 1.0)
+            for attempt in range(retries):
+                try:
+                    value = poll()
+                    break
+                except Exception as e:
+                    print(f"- could not get {event}".ljust(60), end="\r")
+                    print(f"{event.capitalize()} exception: {e}", file=sys.stderr)
+                    if attempt + 1 < retries:
+                        sleep(next(delays))
+            else:
+                return
+            if self._values.get(event) != value:
+                self._values[event] = value
+                self.emit(event, value)
+
+        self.every(interval, check)
+
+    def run(self, until=lambda: False):
+        while self._timers and not until():
+            due, sequence, interval, callback = self._timers[0]
+            delay = due - monotonic()
+            if delay > 0:
+                sleep(delay)
+                continue
+            heapq.heappop(self._timers)
+            callback()
+            # an overrunning callback shifts the timer instead of queueing missed ticks
+            heapq.heappush(self._timers, (max(due + interval, monotonic()), sequence, interval, callback))
+
+
 class EngineBase:
     def __init__(self, args, driver, log_src_path):
         self.args = args
@@ -24,11 +109,20 @@ class EngineBase:
         self.scenario: ScenarioConfig = self.default_scenario()
         self.versions = set()
         self.node: BtcNode | None = None
+        self.gateway = ""
+        self.checkpoint: Checkpoint | None = None
+        self.restoring = False
         self.distributor = None
         self.clients = []
-        self.invoices = {}
+        self.invoices = InvoiceQueue()
+        self.invoice_owners: dict[str, str] = {}
+        # invoice addresses derived ahead of prepare_invoices, by client name
+        self.addresses: dict[str, list[str]] = {}
+        self.payment_stats = None
+        self.payments = PaymentPipeline(self.send_batch, concurrency=PAYMENT_CONCURRENCY, batch_size=BATCH_SIZE)
         self.current_block = 0
         self.current_round = 0
+        self.scheduler = Scheduler()
 
     def default_scenario(self) -> ScenarioConfig:
         raise NotImplementedError
@@ -47,7 +141,7 @@ class EngineBase:
     def prepare_images(self):
         raise NotImplementedError
 
-    def prepare_image(self, name: str, path=None):
+    def prepare_image(self, name: str, path=None, buildargs=None, dockerfile=None):
         prefixed_name = self.args.image_prefix + name
         if self.driver.has_image(prefixed_name):
             if self.args.force_rebuild:
@@ -55,7 +149,7 @@ class EngineBase:
                     self.driver.pull(prefixed_name)
                     print(f"- image pulled {prefixed_name}")
                 else:
-                    self.driver.build(name, f"./containers/{name}" if path is None else path)
+                    self.driver.build(name, f"./containers/{name}" if path is None else path, buildargs, dockerfile)
                     print(f"- image rebuilt {prefixed_name}")
             else:
                 print(f"- image reused {prefixed_name}")
@@ -63,23 +157,38 @@ class EngineBase:
             self.driver.pull(prefixed_name)
             print(f"- image pulled {prefixed_name}")
         else:
-            self.driver.build(name, f"./containers/{name}" if path is None else path)
+            self.driver.build(name, f"./containers/{name}" if path is None else path, buildargs, dockerfile)
             print(f"- image built {prefixed_name}")
 
+    def prepare_btc_node_image(self):
+        if self.args.btc_node_snapshot:
+            # baking the snapshot mines and bootstraps a chain, so it is a separate image
+            self.prepare_image("btc-node-snapshot", "./containers/btc-node", {"SNAPSHOT": "1"})
+        else:
+            self.prepare_image("btc-node")
+
     def start_infrastructure(self):
         print("Starting infrastructure")
+        if self.args.gateway:
+            self.start_gateway()
         self.start_btc_node()
         self.start_engine_infrastructure()
         self.start_distributor()
 
     def start_btc_node(self):
+        snapshot = self.args.btc_node_snapshot
         btc_node_ip, btc_node_ports = self.driver.run(
             "btc-node",
-            f"{self.args.image_prefix}btc-node",
+            f"{self.args.image_prefix}btc-node{'-snapshot' if snapshot else ''}",
+            env={
+                **({"BTC_NODE_SNAPSHOT": "1"} if snapshot else {}),
+                **self.checkpoint_env("btc-node"),
+            },
             ports={18443: 18443, 18444: 18444},
             cpu=4.0,
             memory=8192,
         )
+        self.restore_container("btc-node")
 
         self.node = BtcNode(
             host=btc_node_ip if self.args.proxy else self.args.control_ip,
@@ -87,57 +196,282 @@ class EngineBase:
             internal_ip=btc_node_ip,
             proxy=self.args.proxy,
         )
+        self.wait_bootstrapped()
         self.node.wait_ready()
         print("- started btc-node")
 
+    def wait_bootstrapped(self):
+        """Wait until run.sh reports the chain bootstrapped, restored or copied from the snapshot."""
+        print("- waiting for btc-node to bootstrap the chain")
+        start = monotonic()
+        delays = utils.backoff(0.5, 5.0)
+        while monotonic() - start < BOOTSTRAP_TIMEOUT:
+            try:
+                if self.driver.peek("btc-node", BOOTSTRAP_MARKER).strip() == "bootstrapped":
+                    return
+            except FileNotFoundError:
+                pass
+            sleep(next(delays))
+        raise Exception(
+            f"btc-node did not report a bootstrapped chain in {BOOTSTRAP_TIMEOUT} seconds; "
+            "check its logs, and rebuild the btc-node image (--force-rebuild) if it predates the bootstrap marker"
+        )
+
+    def start_gateway(self):
+        if self.args.proxy:
+            print("- rpc-gateway skipped, containers are already reached through the proxy")
+            return
+        _, gateway_ports = self.driver.run(
+            "rpc-gateway",
+            f"{self.args.image_prefix}rpc-gateway",
+            env={
+                "CONNECT_PORTS": " ".join(map(str, self.gateway_connect_ports())),
+                "ALLOW": self.args.gateway_allow,
+            },
+            ports={GATEWAY_PORT: GATEWAY_PORT},
+            cpu=1.0,
+            memory=512,
+        )
+        self.gateway = f"http://{self.args.control_ip}:{gateway_ports[GATEWAY_PORT]}"
+        print("- started rpc-gateway")
+
+    def gateway_connect_ports(self) -> list[int]:
+        """Client ports the manager reaches over HTTPS, i.e. through CONNECT requests to the gateway."""
+        return []
+
+    @property
+    def rpc_proxy(self):
+        """Proxy the manager uses to reach clients."""
+        return self.gateway or self.args.proxy
+
+    def client_ports(self, ports):
+        """Host ports to publish for a client; none when the gateway routes to it."""
+        return {} if self.gateway else ports
+
+    def client_endpoint(self, name, ip, ports, port):
+        """Return the host and port the manager uses to reach `port` of a client."""
+        if self.gateway:
+            # the gateway resolves container names on the simulation network
+            return ip or name, port
+        if self.args.proxy:
+            return ip, port
+        return self.args.control_ip, ports[port]
+
     def start_engine_infrastructure(self):
         raise NotImplementedError
 
+    def checkpoint_env(self, name):
+        """Environment making container `name` wait for its checkpoint to be restored, or able to be saved."""
+        if self.restoring and self.checkpoint.has_container(name):
+            return {"RESTORE_CHECKPOINT": "1"}
+        if self.checkpoint is not None and not self.restoring:
+            return {"SAVE_CHECKPOINT": "1"}
+        return {}
+
+    def restore_container(self, name):
+        if self.restoring and self.checkpoint.has_container(name):
+            self.checkpoint.restore_container(self.driver.handle(), name)
+            print(f"- restored {name} from checkpoint")
+
+    def checkpoint_paths(self) -> dict[str, list[str]]:
+        """Directories of each container that make up the funded world."""
+        return {"btc-node": ["/home/bitcoin/data"]}
+
+    def save_checkpoint(self):
+        print("Saving checkpoint")
+        if self.node is None:
+            raise RuntimeError("Bitcoin node is not initialized")
+        # pay and confirm the initial invoices, mempool contents are not saved
+        self.update_invoice_payments()
+        self.payments.drain()
+        self.node.mine_block()
+
+        paths = self.checkpoint_paths()
+        # wallets first, bitcoind (and with it mining) last; started again in reverse
+        wallets = [name for name in paths if name != "btc-node"]
+
+        def hold(name):
+            self.checkpoint.hold_container(self.driver.handle(), name)
+
+        def save(name):
+            self.checkpoint.save_container(self.driver.handle(), name, paths[name])
+            print(f"- saved {name}")
+
+        def resume(name):
+            self.checkpoint.resume_container(self.driver.handle(), name)
+
+        try:
+            with multiprocessing.pool.ThreadPool(LOG_WORKERS) as pool:
+                pool.map(hold, wallets)
+                hold("btc-node")
+                print("- stopped daemons")
+                pool.map(save, paths)
+                resume("btc-node")
+                self.node.wait_ready()
+                pool.map(resume, wallets)
+                self.wait_wallets()
+            print("- restarted daemons")
+
+            published = self.checkpoint.save_state(
+                {
+                    "scenario": self.scenario.name,
+                    "containers": paths,
+                    "invoices": self.invoices.buckets(),
+                    "invoice_owners": self.invoice_owners,
+                }
+            )
+        except BaseException:
+            self.checkpoint.discard()
+            raise
+        if published:
+            print(f"- checkpoint saved to {self.checkpoint.path}")
+        else:
+            print(f"- checkpoint {self.checkpoint.path} was saved by a concurrent run, discarded this one")
+
+    def wait_wallets(self):
+        """Wait until the distributor and client wallets are served again after their daemons restarted."""
+        wallets = [self.distributor, *self.clients] if self.distributor is not None else list(self.clients)
+
+        def wait(wallet):
+            if not wallet.wait_wallet(timeout=CLIENT_START_TIMEOUT):
+                raise Exception(f"wallet {wallet.name} did not restart")
+
+        with multiprocessing.pool.ThreadPool(ADDRESS_WORKERS) as pool:
+            pool.map(wait, wallets)
+
+    def restore_state(self):
+        state = self.checkpoint.state
+        self.invoices = InvoiceQueue()
+        for block, round, invoices in state["invoices"]:
+            for invoice in invoices:
+                self.invoices.add(block, round, tuple(invoice))
+        self.invoice_owners = state["invoice_owners"]
+        print(f"- restored {len(self.invoices)} pending invoices")
+
     def start_distributor(self):
         raise NotImplementedError
 
     def init_client(self):
         raise NotImplementedError
 
-    def start_client(self, idx: int, wallet=None):
+    def client_spec(self, idx: int, wallet: WalletConfig) -> dict:
+        raise NotImplementedError
+
+    def connect_client(self, idx: int, wallet: WalletConfig, ip, ports):
         raise NotImplementedError
 
+    def client_groups(self, indexed_wallets):
+        """Split (idx, wallet) pairs into groups that share one container."""
+        return [[item] for item in indexed_wallets]
+
+    def group_spec(self, group) -> dict:
+        return self.client_spec(*group[0])
+
+    def connect_group(self, group, ip, ports):
+        """Connect the wallets of a started container, None for those that failed."""
+        return [self.connect_client(idx, wallet, ip, ports) for idx, wallet in group]
+
+    def start_client(self, idx: int, wallet=None):
+        spec = self.client_spec(idx, wallet)
+        try:
+            ip, ports = self.driver.run(**spec)
+        except Exception as e:
+            print(f"- could not start {spec['name']} ({e})")
+            return None
+        return self.connect_client(idx, wallet, ip, ports)
+
     def stop_client(self, idx: int):
         raise NotImplementedError
 
     def start_clients(self, wallets):
         print("Starting clients")
-        with multiprocessing.pool.ThreadPool() as pool:
-            new_clients = pool.starmap(self.start_client, enumerate(wallets, start=len(self.clients)))
-
-            for _ in range(3):
-                restart_idx = list(
-                    map(
-                        lambda x: x[0],
-                        filter(
-                            lambda x: x[1] is None,
-                            enumerate(new_clients, start=len(self.clients)),
-                        ),
-                    )
-                )
-
-                if not restart_idx:
-                    break
-                print(f"- failed to start {len(restart_idx)} clients; retrying ...")
-                for idx in restart_idx:
-                    self.stop_client(idx)
-                sleep(60)
-                restarted_clients = pool.starmap(
-                    self.start_client,
-                    ((idx, wallets[idx - len(self.clients)]) for idx in restart_idx),
-                )
-                for idx, client in enumerate(restarted_clients):
-                    if client is not None:
-                        new_clients[restart_idx[idx]] = client
+        base = len(self.clients)
+        groups = self.client_groups(list(enumerate(wallets, start=base)))
+        admission = AdmissionController()
+        retries = [(0.0, group_id, 0) for group_id in range(len(groups))]
+        done = queue.SimpleQueue()
+        new_clients = {}
+        failed = 0
+        in_flight = 0
+
+        def connect(group_id, attempt, spec, result, started):
+            group = groups[group_id]
+            clients = [None] * len(group)
+            if isinstance(result, Exception):
+                print(f"- could not start {spec['name']} ({result})")
             else:
-                new_clients = list(filter(lambda x: x is not None, new_clients))
-                print(f"- failed to start {len(wallets) - len(new_clients)} clients; continuing ...")
-        self.clients.extend(new_clients)
+                try:
+                    self.restore_container(spec["name"])
+                    clients = self.connect_group(group, *result)
+                except Exception as e:
+                    print(f"- could not start {spec['name']} ({e})")
+                if self.args.prefetch_addresses and not self.restoring and None not in clients:
+                    # overlap invoice preparation with clients still starting
+                    for (_, wallet), client in zip(group, clients):
+                        try:
+                            self.addresses[client.name] = self.new_addresses(client, len(wallet.funds))
+                        except Exception as e:
+                            print(f"- could not prefetch addresses of {client.name} ({e})")
+            latency = monotonic() - started
+            if None in clients:
+                # returns once the container is gone, so a retry can reuse its name
+                try:
+                    self.stop_client(group[0][0])
+                except Exception as e:
+                    print(f"- could not stop {spec['name']} ({e})")
+            return group_id, attempt, clients, latency
+
+        def launch(batch, specs, started):
+            # runs in the pool, so a slow batch does not hold up handling finished groups
+            try:
+                launched = self.driver.handle().run_many(specs)
+            except Exception as e:
+                launched = [e] * len(specs)
+            for (_, group_id, attempt), spec, result in zip(batch, specs, launched):
+                pool.apply_async(connect, (group_id, attempt, spec, result, started), callback=done.put)
+
+        # a worker per starting client, plus one per batch being launched
+        with multiprocessing.pool.ThreadPool(2 * admission.maximum) as pool:
+            while retries or in_flight:
+                now = monotonic()
+                batch = []
+                slots = admission.available()
+                while retries and retries[0][0] <= now and len(batch) < slots:
+                    batch.append(heapq.heappop(retries))
+
+                if batch:
+                    specs = [self.group_spec(groups[group_id]) for _, group_id, _ in batch]
+                    for spec in specs:
+                        spec["env"] = {**(spec.get("env") or {}), **self.checkpoint_env(spec["name"])}
+                    admission.admit(len(batch))
+                    pool.apply_async(launch, (batch, specs, monotonic()))
+                    in_flight += len(batch)
+                    continue
+
+                timeout = START_POLL_INTERVAL
+                if retries and not in_flight:
+                    timeout = max(retries[0][0] - now, 0.0)
+                try:
+                    group_id, attempt, clients, latency = done.get(timeout=timeout)
+                except queue.Empty:
+                    continue
+                in_flight -= 1
+                success = None not in clients
+                admission.release(latency, success)
+
+                if success:
+                    for (idx, _), client in zip(groups[group_id], clients):
+                        new_clients[idx] = client
+                elif attempt + 1 < START_ATTEMPTS:
+                    delay = START_RETRY_DELAY * 2**attempt * random.uniform(1.0, 1.5)
+                    heapq.heappush(retries, (monotonic() + delay, group_id, attempt + 1))
+                    print(f"- retrying client {groups[group_id][0][0]} in {delay:.0f} seconds (limit {admission.limit})")
+                else:
+                    failed += len(groups[group_id])
+
+        if failed:
+            print(f"- failed to start {failed} clients; continuing ...")
+        self.clients.extend(new_clients[idx] for idx in sorted(new_clients))
 
     def fund_distributor(self, btc_amount):
         print("Funding distributor")
@@ -146,65 +480,98 @@ class EngineBase:
         if self.distributor is None:
             raise RuntimeError("Distributor is not initialized")
 
-        for _ in range(DISTRIBUTOR_UTXOS):
-            self.node.fund_address(
-                self.distributor.get_new_address(),
-                math.ceil(btc_amount * BTC / DISTRIBUTOR_UTXOS) // BTC,
-            )
+        # one output per coin the distributor can spend in parallel
+        utxos = max(self.args.distributor_utxos, 1)
+        amount = btc_amount * BTC // utxos
+        addresses = [self.distributor.get_new_address() for _ in range(utxos)]
+        txid = self.node.fund_addresses({address: amount for address in addresses})
+        print(f"- sent {utxos} outputs of {amount / BTC:.8f} BTC in {txid}")
 
-        while (balance := self.distributor.get_balance()) < btc_amount * BTC:
-            sleep(1)
+        delays = utils.backoff(0.1, 2.0)
+        while (balance := self.distributor.get_balance()) < utxos * amount:
+            sleep(next(delays))
         print(f"- funded (current balance {balance / BTC:.8f} BTC)")
 
-    def store_client_logs(self, client, data_path):
-        sleep(random.random() * 3)
+    def store_client_logs(self, client, data_path, download=True):
         client_path = os.path.join(data_path, client.name)
-        os.mkdir(client_path)
-        with open(os.path.join(client_path, "coins.json"), "w") as f:
-            json.dump(client.list_coins(), f, indent=2)
-            print(f"- stored {client.name} coins")
-        with open(os.path.join(client_path, "unspent_coins.json"), "w") as f:
-            json.dump(client.list_unspent_coins(), f, indent=2)
-            print(f"- stored {client.name} unspent coins")
-        with open(os.path.join(client_path, "keys.json"), "w") as f:
-            json.dump(client.list_keys(), f, indent=2)
-            print(f"- stored {client.name} keys")
+        os.makedirs(client_path, exist_ok=True)
+        try:
+            for file_name, listing in (
+                ("coins.json", client.list_coins),
+                ("unspent_coins.json", client.list_unspent_coins),
+                ("keys.json", client.list_keys),
+            ):
+                with open(os.path.join(client_path, file_name), "wb") as f:
+                    f.write(dumps(listing()))
+            print(f"- stored {client.name} coins and keys")
+        except Exception as e:
+            print(f"- could not store {client.name} coins and keys ({e})")
+        if not download:
+            return
+        # wallets packed in one container share its logs
+        container = getattr(client, "container", client.name)
         try:
-            self.driver.download(client.name, self.log_src_path, client_path)
+            self.driver.handle().download(
+                container,
+                self.log_src_path,
+                os.path.join(data_path, container),
+                compress=self.args.compress_logs,
+            )
 
-            print(f"- stored {client.name} logs")
+            print(f"- stored {container} logs")
         except:
-            print(f"- could not store {client.name} logs")
+            print(f"- could not store {container} logs")
+
+    @cached_property
+    def experiment_path(self):
+        time = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M")
+        return f"./logs/{time}_{self.args.name_prefix}{self.scenario.name}"
+
+    @property
+    def archive_path(self):
+        return os.path.join(self.experiment_path, "data", "btc-node", "blocks.ndjson.gz")
+
+    def start_archiver(self):
+        if self.node is None:
+            raise RuntimeError("Bitcoin node is not initialized")
+        os.makedirs(os.path.dirname(self.archive_path), exist_ok=True)
+        self.node.start_archiver(self.archive_path)
+        print("- started chain archiver")
 
     def store_logs(self):
         print("Storing logs")
-        time = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M")
-        experiment_path = f"./logs/{time}_{self.scenario.name}"
+        experiment_path = self.experiment_path
         data_path = os.path.join(experiment_path, "data")
-        os.makedirs(data_path)
+        os.makedirs(data_path, exist_ok=True)
 
         with open(os.path.join(experiment_path, "scenario.json"), "w") as f:
             json.dump(self.scenario.to_dict(), f, indent=2)
             print("- stored scenario")
 
-        stored_blocks = 0
-        node_path = os.path.join(data_path, "btc-node")
-        os.mkdir(node_path)
+        if self.payment_stats is not None:
+            with open(os.path.join(experiment_path, "payments.json"), "w") as f:
+                json.dump(self.payment_stats, f, indent=2)
+            print("- stored payment statistics")
+
         if self.node is None:
             raise RuntimeError("Bitcoin node is not initialized")
-        while stored_blocks < self.node.get_block_count():  # type: ignore
-            block_hash = self.node.get_block_hash(stored_blocks)
-            block = self.node.get_block_info(block_hash)
-            with open(os.path.join(node_path, f"block_{stored_blocks}.json"), "w") as f:
-                json.dump(block, f, indent=2)
-            stored_blocks += 1
+        os.makedirs(os.path.dirname(self.archive_path), exist_ok=True)
+        if self.node.archiver is not None:
+            stored_blocks = self.node.stop_archiver()
+        else:
+            stored_blocks = export_blocks(self.node, self.archive_path, 0, self.node.get_block_count() + 1)
         print(f"- stored {stored_blocks} blocks")
 
         self.store_engine_logs(data_path)
 
-        # TODO parallelize (driver cannot be simply passed to new threads)
-        for client in self.clients:
-            self.store_client_logs(client, data_path)
+        with multiprocessing.pool.ThreadPool(LOG_WORKERS) as pool:
+            containers = set()
+            jobs = []
+            for client in self.clients:
+                container = getattr(client, "container", client.name)
+                jobs.append((client, data_path, container not in containers))
+                containers.add(container)
+            pool.starmap(self.store_client_logs, jobs)
 
         shutil.make_archive(experiment_path, "zip", *os.path.split(experiment_path))
         print("- zip archive created")
@@ -212,6 +579,16 @@ class EngineBase:
     def store_engine_logs(self, data_path):
         raise NotImplementedError
 
+    def stop_payments(self):
+        print("Stopping payments")
+        if not self.payments.close(PAYMENT_DRAIN_TIMEOUT):
+            print(f"- payments did not finish in {PAYMENT_DRAIN_TIMEOUT} seconds")
+        self.payment_stats = {**self.payments.stats(), "not_due": len(self.invoices)}
+        stats = self.payment_stats
+        print(
+            f"- {stats['paid']} invoices paid, {stats['dropped']} dropped, {stats['unpaid']} unpaid, {stats['not_due']} not yet due"
+        )
+
     def stop_coinjoins(self):
         print("Stopping coinjoins")
         for client in self.clients:
@@ -219,16 +596,27 @@ class EngineBase:
             print(f"- stopped mixing {client.name}")
 
     def update_invoice_payments(self):
-        due = list(filter(lambda x: x[0] <= self.current_block and x[1] <= self.current_round, self.invoices.keys()))
-        for i in due:
-            self.pay_invoices(self.invoices.pop(i, []))
+        due = self.invoices.due(self.current_block, self.current_round)
+        if due:
+            random.shuffle(due)
+            self.pay_invoices(due)
+
+    def new_addresses(self, client, count):
+        # neither Wasabi nor jmwalletd derive several addresses in one call
+        cached = self.addresses.pop(client.name, [])
+        return cached[:count] + [client.get_new_address() for _ in range(count - len(cached))]
 
     def prepare_invoices(self, wallets: list[WalletConfig]):
         print("Preparing invoices")
         client_invoices = [(client, wallet.funds) for client, wallet in zip(self.clients, wallets)]
 
-        for client, funds in client_invoices:
-            for fund in funds:
+        with multiprocessing.pool.ThreadPool(ADDRESS_WORKERS) as pool:
+            client_addresses = pool.starmap(
+                self.new_addresses, [(client, len(funds)) for client, funds in client_invoices]
+            )
+
+        for (client, funds), addresses in zip(client_invoices, client_addresses):
+            for fund, address in zip(funds, addresses):
                 block = 0
                 round = 0
                 if isinstance(fund, int):
@@ -237,56 +625,105 @@ class EngineBase:
                     value = fund.value
                     block = fund.delay_blocks or 0
                     round = fund.delay_rounds or 0
-                addressed_invoice = (client.get_new_address(), value)
-                if (block, round) not in self.invoices:
-                    self.invoices[(block, round)] = [addressed_invoice]
-                else:
-                    self.invoices[(block, round)].append(addressed_invoice)
-
-        for addressed_invoices in self.invoices.values():
-            random.shuffle(addressed_invoices)
+                addressed_invoice = (address, value)
+                self.invoice_owners[addressed_invoice[0]] = client.name
+                self.invoices.add(block, round, addressed_invoice)
 
-        print(f"- prepared {sum(map(len, self.invoices.values()))} invoices")
+        print(f"- prepared {len(self.invoices)} invoices")
 
     def pay_invoices(self, addressed_invoices):
+        if self.args.direct_funding:
+            self.pay_invoices_direct(addressed_invoices)
+            return
+        self.payments.submit(addressed_invoices)
         print(
-            f"- paying {len(addressed_invoices)} invoices (batch size {BATCH_SIZE}, block {self.current_block}, round {self.current_round})"
+            f"- paying {len(addressed_invoices)} invoices (batch size {self.payments.batch_size}, {self.payments.pending()} pending, block {self.current_block}, round {self.current_round})"
         )
-        try:
-            for batch in utils.batched(addressed_invoices, BATCH_SIZE):
-                for _ in range(3):
-                    try:
-                        if self.distributor is None:
-                            raise RuntimeError("Distributor is not initialized")
-                        result = self.distributor.send(batch)
-                        if str(result) == "timeout":
-                            print("- transaction timeout")
-                            continue
-                        break
-                    except Exception as e:
-                        # https://github.com/zkSNACKs/WalletWasabi/issues/12764
-                        if "Bad Request" in str(e):
-                            print("- transaction error (bad request)")
-                        else:
-                            print(f"- transaction error ({e})")
-                else:
-                    print("- invoice payment failed")
-                    raise Exception("Invoice payment failed")
 
-        except Exception as e:
-            print("- invoice payment failed")
-            pass
-            sleep(360)
+    def send_batch(self, batch):
+        """Pay one batch of invoices from the distributor."""
+        if self.distributor is None:
+            raise RuntimeError("Distributor is not initialized")
+        return self.distributor.send(batch)
+
+    def pay_invoices_direct(self, addressed_invoices):
+        """Pay invoices from the node wallet, bypassing the distributor."""
+        print(
+            f"- paying {len(addressed_invoices)} invoices directly (batch size {DIRECT_BATCH_SIZE}, block {self.current_block}, round {self.current_round})"
+        )
+        if self.node is None:
+            raise RuntimeError("Bitcoin node is not initialized")
+        for batch in utils.batched(addressed_invoices, DIRECT_BATCH_SIZE):
+            amounts = defaultdict(int)
+            for address, amount in batch:
+                amounts[address] += amount
+            for _ in range(3):
+                try:
+                    result = self.node.fund_addresses(amounts)
+                    if str(result) == "timeout":
+                        # the transaction may still have been sent, do not pay twice
+                        print("- transaction timeout")
+                        self.payments.dropped += len(batch)
+                    else:
+                        self.payments.paid += len(batch)
+                    break
+                except Exception as e:
+                    print(f"- transaction error ({e})")
+            else:
+                print("- invoice payment failed")
+                self.payments.dropped += len(batch)
 
     def run(self):
         print(f"=== Scenario {self.scenario.name} ===")
+        if self.args.checkpoint:
+            key = checkpoint_key(
+                type(self).__name__,
+                self.scenario,
+                wallets_per_container=self.args.wallets_per_container,
+                distributor_utxos=self.args.distributor_utxos,
+                direct_funding=self.args.direct_funding,
+            )
+            self.checkpoint = Checkpoint(os.path.join(CHECKPOINT_DIR, f"{self.scenario.name}-{key}"))
+            self.restoring = self.checkpoint.exists
+            if self.restoring:
+                print(f"- restoring checkpoint {self.checkpoint.path}")
         self.prepare_images()
+        if self.args.gateway:
+            self.prepare_image("rpc-gateway")
         self.start_infrastructure()
-        self.fund_distributor(500)
-        self.start_clients(self.scenario.wallets)
-        self.prepare_invoices(self.scenario.wallets)
+        if not self.args.no_logs:
+            self.start_archiver()
+        if self.restoring:
+            self.start_clients(self.scenario.wallets)
+            self.restore_state()
+        else:
+            if not self.args.direct_funding:
+                self.fund_distributor(500)
+            self.start_clients(self.scenario.wallets)
+            self.prepare_invoices(self.scenario.wallets)
+            if self.checkpoint is not None:
+                self.save_checkpoint()
         print("Running simulation")
         self.run_engine()
 
     def run_engine(self):
         raise NotImplementedError
+
+    def limit_reached(self):
+        raise NotImplementedError
+
+    def on_block(self, block):
+        self.current_block = block
+        self.update_invoice_payments()
+        self.print_progress()
+
+    def on_round(self, round):
+        self.current_round = round
+        self.update_invoice_payments()
+        self.print_progress()
+
+    def print_progress(self):
+        print(
+            f"- coinjoin rounds: {self.current_round} (block {self.current_block})".ljust(60),
+            end="\r",
+        )
@@ -1,13 +1,18 @@
-from manager.engine.engine_base import EngineBase
+from manager.engine.engine_base import EngineBase, CLIENT_START_TIMEOUT
 from manager.engine.configuration import ScenarioConfig, WalletConfig, JoinMarketConfig, JoinMarketRole
 from manager.wasabi_clients.joinmarket_client import JoinMarketClientServer
+from manager.driver import tcp_probe
 from time import sleep, time
-import sys
+
+# extra memory for every additional wallet in a packed container
+PACKED_WALLET_MEMORY = 256
 
 class JoinmarketEngine(EngineBase):
 
     def __init__(self, args, driver):
         super().__init__(args, driver, "/home/joinmarket")
+        # the distributor wallet sends one payment at a time
+        self.payments.concurrency = 1
 
     def default_scenario(self) -> ScenarioConfig:
         return ScenarioConfig(
@@ -70,7 +75,7 @@ class JoinmarketEngine(EngineBase):
 
     def prepare_images(self):
         print("Preparing images")
-        self.prepare_image("btc-node")
+        self.prepare_btc_node_image()
         self.prepare_image("joinmarket-client-server")
         self.prepare_image("irc-server")
 
@@ -78,8 +83,10 @@ class JoinmarketEngine(EngineBase):
     def start_engine_infrastructure(self):
         if self.node is None:
             raise RuntimeError("Bitcoin node is not initialized")
-        self.node.create_wallet("jm_wallet")
-        print("- created jm_wallet in BitcoinCore")
+        if not self.restoring:
+            # a restored node loads jm_wallet on startup
+            self.node.create_wallet("jm_wallet")
+            print("- created jm_wallet in BitcoinCore")
 
         self.start_irc_server()
         print("- started irc-server")
@@ -109,18 +116,24 @@ class JoinmarketEngine(EngineBase):
             ip, manager_ports = self.driver.run(
                 name,
                 "joinmarket-client-server:latest",
-                env={},  # Add any necessary environment variables
-                ports={28183: port},
+                env=self.checkpoint_env(name),
+                ports=self.client_ports({28183: port}),
                 cpu=1.0,
                 memory=2048,
+                healthcheck=tcp_probe(28183),
             )
         except Exception as e:
             print(f"- could not start {name} ({e})")
             raise Exception("Could not start distributor")
+        self.restore_container(name)
 
-        self.distributor = self.init_joinmarket_clientserver(name=name, port=port)
+        host, port = self.client_endpoint(name, ip, manager_ports, 28183)
+        self.distributor = self.init_joinmarket_clientserver(name=name, port=port, host=host)
 
         start = time()
+        if not self.driver.wait_healthy(name, timeout=CLIENT_START_TIMEOUT):
+            print(f"- could not start {name} (health check timeout)")
+            raise Exception("Could not start distributor")
         if not self.distributor.wait_wallet(timeout=60):
             print(f"- could not start {name} (application timeout)")
             raise Exception("Could not start distributor")
@@ -128,46 +141,90 @@ class JoinmarketEngine(EngineBase):
 
 
     def init_joinmarket_clientserver(self, name, port, host="localhost", type="maker"):
-        return JoinMarketClientServer(name=name, port=port, type=type)
-
-
-    def start_client(self, idx: int, wallet: WalletConfig):
-        name = f"jcs-{idx:03}"
-        port = 28184 + idx
-        try:
-            ip, manager_ports = self.driver.run(
-                name,
-                "joinmarket-client-server:latest",
-                env={},
-                ports={28183: port},
-                cpu=(0.1),
-                memory=(768),
-            )
-        except Exception as e:
-            print(f"- could not start {name} ({e})")
-            return None
-
-        print(f"driver starting {name}")
-
-        delay = (wallet.delay_blocks or 0, wallet.delay_rounds or 0)
-        stop = (wallet.stop_blocks or 0, wallet.stop_rounds or 0)
-        
-        # Get JoinMarket role
-        joinmarket_config = wallet.joinmarket
-        role_str = joinmarket_config.role.value if joinmarket_config and joinmarket_config.role else "maker"
-
-        client = JoinMarketClientServer(name=name, port=port, type=role_str, delay=delay, stop=stop)
+        return JoinMarketClientServer(host=host, name=name, port=port, proxy=self.rpc_proxy, type=type)
+
+
+    def client_spec(self, idx: int, wallet: WalletConfig) -> dict:
+        return self.group_spec([(idx, wallet)])
+
+    def client_groups(self, indexed_wallets):
+        # roles are per wallet, so any consecutive wallets can share a container
+        size = max(self.args.wallets_per_container, 1)
+        return [indexed_wallets[i : i + size] for i in range(0, len(indexed_wallets), size)]
+
+    def group_spec(self, group) -> dict:
+        # wallet k of the container is served by its own jmwalletd on port 28183 + k
+        ports = {28183 + k: 28184 + idx for k, (idx, _) in enumerate(group)}
+        return dict(
+            name=f"jcs-{group[0][0]:03}",
+            image="joinmarket-client-server:latest",
+            env={"JM_WALLETS": str(len(group))},
+            ports=self.client_ports(ports),
+            cpu=(0.1),
+            memory=(768 + PACKED_WALLET_MEMORY * (len(group) - 1)),
+            healthcheck=tcp_probe(*ports),
+        )
 
+    def gateway_connect_ports(self):
+        # wallet k of a container is served on port 28183 + k, the distributor on 28183
+        size = max(self.args.wallets_per_container, 1)
+        return [28183 + k for k in range(size)]
+
+    def checkpoint_paths(self):
+        paths = super().checkpoint_paths()
+        paths["joinmarket-distributor"] = ["/home/joinmarket/.joinmarket"]
+        started = {client.container for client in self.clients}
+        for group in self.client_groups(list(enumerate(self.scenario.wallets))):
+            container = f"jcs-{group[0][0]:03}"
+            if container in started:
+                paths[container] = ["/home/joinmarket/.joinmarket"] + [
+                    f"/home/joinmarket/.joinmarket-{k}" for k in range(1, len(group))
+                ]
+        return paths
+
+    def connect_client(self, idx: int, wallet: WalletConfig, ip, manager_ports):
+        return self.connect_group([(idx, wallet)], ip, manager_ports)[0]
+
+    def connect_group(self, group, ip, manager_ports):
+        container = f"jcs-{group[0][0]:03}"
+        print(f"driver starting {container}")
 
         start = time()
-        if not client.wait_wallet(timeout=60):
-            print(
-                f"- could not start {name} (application timeout {time() - start} seconds)"
+        if not self.driver.wait_healthy(container, timeout=CLIENT_START_TIMEOUT):
+            print(f"- could not start {container} (health check timeout {time() - start} seconds)")
+            return [None] * len(group)
+
+        clients = []
+        for k, (idx, wallet) in enumerate(group):
+            name = f"jcs-{idx:03}"
+            delay = (wallet.delay_blocks or 0, wallet.delay_rounds or 0)
+            stop = (wallet.stop_blocks or 0, wallet.stop_rounds or 0)
+
+            # Get JoinMarket role
+            joinmarket_config = wallet.joinmarket
+            role_str = joinmarket_config.role.value if joinmarket_config and joinmarket_config.role else "maker"
+
+            host, port = self.client_endpoint(container, ip, manager_ports, 28183 + k)
+            client = JoinMarketClientServer(
+                host=host,
+                name=name,
+                port=port,
+                proxy=self.rpc_proxy,
+                type=role_str,
+                delay=delay,
+                stop=stop,
+                container=container,
             )
-            return None
 
-        print(f"- started {client.name} (wait took {time() - start} seconds)")
-        return client
+            if not client.wait_wallet(timeout=60):
+                print(
+                    f"- could not start {name} (application timeout {time() - start} seconds)"
+                )
+                client = None
+            else:
+                print(f"- started {client.name} (wait took {time() - start} seconds)")
+            clients.append(client)
+        return clients
 
     def stop_client(self, idx: int):
         name = f"jcs-{idx:03}"
@@ -199,36 +256,33 @@ class JoinmarketEngine(EngineBase):
                 print(f"Stopping coinjoin {client.name}")
 
 
+    def limit_reached(self):
+        return (self.scenario.rounds != 0 and self.current_round >= self.scenario.rounds) or (
+            self.scenario.blocks != 0 and self.current_block >= self.scenario.blocks
+        )
+
     def run_engine(self):
         if self.node is None:
             raise RuntimeError("Bitcoin node is not initialized")
-            
+        node = self.node
+
         self.update_invoice_payments()
-        initial_block = self.node.get_block_count()
+        self.payments.drain()
+        initial_block = node.get_block_count()
         for i in range(5):
             # Takers need 3 confirmations of transactions for the sourcing commitments
-            self.node.mine_block()
-
-        while (self.scenario.rounds == 0 or self.current_round < self.scenario.rounds) and (
-                self.scenario.blocks == 0 or self.current_block < self.scenario.blocks):
-            for _ in range(3):
-                try:
-                    self.current_block = self.node.get_block_count() - initial_block  # type: ignore
-                    break
-                except Exception as e:
-                    print(f"- could not get blocks".ljust(60), end="\r")
-                    print(f"Block exception: {e}", file=sys.stderr)
-
-            self.update_invoice_payments()
-            self.update_coinjoins_joinmarket()
-
-            print(
-                f"- coinjoin rounds: {self.current_round} (block {self.current_block})".ljust(60),
-                end="\r",
-            )
-            sleep(1)
+            node.mine_block()
+
+        self.scheduler.on("rounds", self.on_round)
+        self.scheduler.on("blocks", self.on_block)
+        # rounds are counted by update_coinjoins_joinmarket, round-delayed invoices follow them
+        self.scheduler.watch("rounds", lambda: self.current_round)
+        self.scheduler.watch("blocks", lambda: node.get_block_count() - initial_block)
+        # a taker that finishes mid-block is followed by the next one right away
+        self.scheduler.every(1.0, self.update_coinjoins_joinmarket)
+        self.scheduler.run(until=self.limit_reached)
 
         print()
         print(f"- limit reached")
         sleep(60)
-        self.node.mine_block()
+        node.mine_block()
@@ -0,0 +1,195 @@
+"""Scheduling of invoices and their background payment in adaptively sized batches."""
+
+from time import monotonic
+import collections
+import heapq
+import itertools
+import threading
+
+
+class InvoiceQueue:
+    """Invoices ordered by the (block, round) at which they become due.
+
+    Both counters only grow, so buckets wait in a heap keyed by block until
+    their block is reached and then in a heap keyed by round; a tick pops
+    only the buckets that are due.
+    """
+
+    def __init__(self):
+        self._buckets: dict[tuple[int, int], list] = {}
+        self._by_block = []
+        self._by_round = []
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, block, round, invoice):
+        bucket = self._buckets.get((block, round))
+        if bucket is None:
+            bucket = self._buckets[(block, round)] = []
+            heapq.heappush(self._by_block, (block, round))
+        bucket.append(invoice)
+        self._size += 1
+
+    def due(self, block, round):
+        """Remove and return all invoices due at `block` and `round`, merged into one list."""
+        while self._by_block and self._by_block[0][0] <= block:
+            key = heapq.heappop(self._by_block)
+            heapq.heappush(self._by_round, (key[1], key[0]))
+        invoices = []
+        while self._by_round and self._by_round[0][0] <= round:
+            key_round, key_block = heapq.heappop(self._by_round)
+            invoices.extend(self._buckets.pop((key_block, key_round)))
+        self._size -= len(invoices)
+        return invoices
+
+    def buckets(self):
+        """Return the pending invoices as (block, round, invoices) tuples."""
+        return [(block, round, invoices) for (block, round), invoices in self._buckets.items()]
+
+
+class PaymentPipeline:
+    """Pays submitted invoices with up to `concurrency` batches in flight.
+
+    The batch size grows while batches are sent faster than `target_latency`
+    and is halved when one fails or is slow. Invoices of a failed batch are
+    retried after `retry_delay` seconds, doubled after each further failure,
+    and dropped after `attempts` attempts; a batch whose send timed out may
+    have been paid and is dropped at once. The caller is never blocked.
+    """
+
+    def __init__(
+        self,
+        send,
+        concurrency=4,
+        batch_size=20,
+        minimum=1,
+        maximum=200,
+        target_latency=30.0,
+        retry_delay=30.0,
+        attempts=3,
+    ):
+        self.send = send
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.retry_delay = retry_delay
+        self.attempts = attempts
+        self.paid = 0
+        self.dropped = 0
+        self._closed = False
+        self._pending = collections.deque()
+        self._retries = []
+        self._sequence = itertools.count()
+        self._in_flight = 0
+        self._workers: list[threading.Thread] = []
+        self._condition = threading.Condition()
+
+    def submit(self, invoices):
+        with self._condition:
+            self._pending.extend((invoice, 0) for invoice in invoices)
+            if not self._workers:
+                for _ in range(self.concurrency):
+                    worker = threading.Thread(target=self._work, daemon=True)
+                    worker.start()
+                    self._workers.append(worker)
+            self._condition.notify_all()
+
+    def pending(self):
+        with self._condition:
+            return len(self._pending) + len(self._retries) + self._in_flight
+
+    def drain(self, timeout=None):
+        """Wait until all submitted invoices are paid or dropped."""
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._pending and not self._retries and not self._in_flight, timeout
+            )
+
+    def close(self, timeout=None):
+        """Wait up to `timeout` seconds for submitted invoices, then stop the workers.
+
+        Batches still in flight are finished; invoices not yet sent stay unpaid.
+        """
+        drained = self.drain(timeout)
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        return drained
+
+    def stats(self):
+        """Return counts of paid, dropped and unpaid invoices; batches still in flight count as unpaid."""
+        with self._condition:
+            unpaid = len(self._pending) + len(self._retries) + self._in_flight
+            return {"paid": self.paid, "dropped": self.dropped, "unpaid": unpaid}
+
+    def _next_batch(self):
+        # called with the condition held, returns None if nothing is due yet
+        now = monotonic()
+        while self._retries and self._retries[0][0] <= now:
+            _, _, invoice, attempt = heapq.heappop(self._retries)
+            self._pending.appendleft((invoice, attempt))
+        if not self._pending:
+            return None
+        size = min(self.batch_size, len(self._pending))
+        return [self._pending.popleft() for _ in range(size)]
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._closed and (batch := self._next_batch()) is None:
+                    timeout = self._retries[0][0] - monotonic() if self._retries else None
+                    self._condition.wait(timeout)
+                if self._closed:
+                    return
+                self._in_flight += len(batch)
+
+            start = monotonic()
+            timed_out = False
+            try:
+                result = self.send([invoice for invoice, _ in batch])
+                timed_out = str(result) == "timeout"
+                success = not timed_out
+                if timed_out:
+                    # the transaction may still have been sent, do not pay twice
+                    print(f"- transaction timeout ({len(batch)} invoices dropped)")
+            except Exception as e:
+                # https://github.com/zkSNACKs/WalletWasabi/issues/12764
+                if "Bad Request" in str(e):
+                    print("- transaction error (bad request)")
+                else:
+                    print(f"- transaction error ({e})")
+                success = False
+
+            with self._condition:
+                self._in_flight -= len(batch)
+                self._adapt(monotonic() - start, success)
+                if success:
+                    self.paid += len(batch)
+                elif timed_out:
+                    self.dropped += len(batch)
+                else:
+                    self._retry(batch)
+                self._condition.notify_all()
+
+    def _adapt(self, latency, success):
+        if success and latency < self.target_latency:
+            self.batch_size = min(self.batch_size + max(self.batch_size // 10, 1), self.maximum)
+        else:
+            self.batch_size = max(self.batch_size // 2, self.minimum)
+
+    def _retry(self, batch):
+        dropped = 0
+        for invoice, attempt in batch:
+            attempt += 1
+            if attempt >= self.attempts:
+                dropped += 1
+                continue
+            due = monotonic() + self.retry_delay * 2 ** (attempt - 1)
+            heapq.heappush(self._retries, (due, next(self._sequence), invoice, attempt))
+        if dropped:
+            self.dropped += dropped
+            print(f"- invoice payment failed ({dropped} invoices dropped)")
@@ -1,8 +1,9 @@
 import os
 from traceback import print_exception
 
-from manager.engine.engine_base import EngineBase
+from manager.engine.engine_base import EngineBase, CLIENT_START_TIMEOUT, BTC
 from manager.engine.configuration import ScenarioConfig, WalletConfig, WasabiConfig
+from manager.engine.activation import ActivationSchedule
 from manager.wasabi_backend_protocol import WasabiBackendProtocol
 from manager.wasabi_coordinator_protocol import WasabiCoordinatorProtocol
 from manager.wasabi_backend_factory import (
@@ -14,14 +15,24 @@ from manager.wasabi_backend_factory import (
     BackendArchitecture,
 )
 from manager.wasabi_clients import WasabiClient
+from manager.wasabi_clients.coin_index import CoinIndex
+from manager.driver import FileFollower, tcp_probe
 from time import sleep, time
-import sys
 import random
 import json
 import tempfile
 import multiprocessing
 import multiprocessing.pool
 
+# extra memory for every additional wallet in a packed client container
+PACKED_WALLET_MEMORY = 192
+# wallets, keys and filters of a client container
+CLIENT_DATA_DIR = "/home/wasabi/.walletwasabi/client"
+# sat/vB assumed when the node has no fee estimate, and the margin over the estimate
+# left for the fee the distributor actually pays (it targets two blocks as well)
+DEFAULT_FEE_RATE = 10.0
+FEE_RATE_MARGIN = 2.0
+
 
 class WasabiEngine(EngineBase):
     def __init__(self, args, driver):
@@ -29,6 +40,12 @@ class WasabiEngine(EngineBase):
         self.backend: WasabiBackendProtocol | None = None
         self.backend_architecture: BackendArchitecture | None = None
         self.round_ids: set[str] = set()
+        self.round_store: FileFollower | None = None
+        self.stored_rounds = 0
+        self.activation: ActivationSchedule | None = None
+        self.funded_clients: set[str] = set()
+        self.coin_index: CoinIndex | None = None
+        self.fee_rate: float | None = None
         super().__init__(args, driver, "/home/wasabi/.walletwasabi/backend/")
 
     def default_scenario(self) -> ScenarioConfig:
@@ -53,7 +70,7 @@ class WasabiEngine(EngineBase):
 
     def prepare_images(self):
         print("Preparing images")
-        self.prepare_image("btc-node")
+        self.prepare_btc_node_image()
         self.prepare_client_images()
 
         self.backend_architecture = self.determine_backend_architecture()
@@ -62,9 +79,10 @@ class WasabiEngine(EngineBase):
 
     def prepare_client_images(self):
         for version in self.versions:
-            name = f"wasabi-client:{version}"
-            path = f"./containers/wasabi-clients/{version}"
-            self.prepare_image(name, path)
+            # versions share the scripts at the top of the context, e.g. checkpoint.sh
+            self.prepare_image(
+                f"wasabi-client:{version}", "./containers/wasabi-clients", dockerfile=f"{version}/Dockerfile"
+            )
 
     def start_engine_infrastructure(self):
         if self.backend_architecture is None:
@@ -167,39 +185,48 @@ class WasabiEngine(EngineBase):
             env={
                 "ADDR_BTC_NODE": self.args.btc_node_ip or self.node.internal_ip,
                 "ADDR_WASABI_BACKEND": self.args.wasabi_backend_ip or backend_address,
+                **self.checkpoint_env("wasabi-client-distributor"),
             },
-            ports={37128: 37131},
+            ports=self.client_ports({37128: 37131}),
             cpu=1.0,
             memory=2048,
+            healthcheck=tcp_probe(37128),
         )
+        self.restore_container("wasabi-client-distributor")
 
+        host, port = self.client_endpoint(
+            "wasabi-client-distributor", wasabi_client_distributor_ip, wasabi_client_distributor_ports, 37128
+        )
         self.distributor = self.init_wasabi_client(
             distributor_version,
-            wasabi_client_distributor_ip if self.args.proxy else self.args.control_ip,
-            port=37128 if self.args.proxy else wasabi_client_distributor_ports[37128],
+            host,
+            port=port,
             name="wasabi-client-distributor",
             delay=(0, 0),
             stop=(0, 0),
         )
+        if not self.driver.wait_healthy("wasabi-client-distributor", timeout=360):
+            print(f"- could not start distributor (health check timeout)")
+            raise Exception("Could not start distributor")
         if not self.distributor.wait_wallet(timeout=360):
             print(f"- could not start distributor (application timeout)")
             raise Exception("Could not start distributor")
         print("- started distributor")
 
-    def init_wasabi_client(self, version, ip, port, name, delay, stop):
+    def init_wasabi_client(self, version, ip, port, name, delay, stop, skip_rounds=None, **kwargs):
         return WasabiClient(version)(
             host=ip,
             port=port,
             name=name,
-            proxy=self.args.proxy,
+            proxy=self.rpc_proxy,
             version=version,
             delay=delay,
             stop=stop,
+            skip_rounds=skip_rounds,
+            **kwargs,
         )
 
-    def start_client(self, idx: int, wallet: WalletConfig | None = None):
-        if wallet is None:
-            raise ValueError("wallet parameter is required")
+    def client_spec(self, idx: int, wallet: WalletConfig) -> dict:
         version = wallet.version or self.scenario.default_version
 
         wasabi_config = wallet.wasabi
@@ -229,38 +256,114 @@ class WasabiEngine(EngineBase):
 
         backend_address = self.backend.internal_ip
 
-        sleep(random.random() * 3)
-        name = f"wasabi-client-{idx:03}"
-        try:
-            ip, manager_ports = self.driver.run(
-                name,
-                f"{self.args.image_prefix}wasabi-client:{version}",
-                env={
-                    "ADDR_BTC_NODE": self.args.btc_node_ip or self.node.internal_ip,
-                    "ADDR_WASABI_BACKEND": self.args.wasabi_backend_ip or backend_address,
-                    "WASABI_ANON_SCORE_TARGET": (str(anon_score_target) if anon_score_target else None),
-                    "WASABI_REDCOIN_ISOLATION": (str(redcoin_isolation) if redcoin_isolation else None),
-                },
-                ports={37128: 37132 + idx},
-                cpu=(0.3 if version < "2.0.4" else 0.1),
-                memory=(1024 if version < "2.0.4" else 768),
+        return dict(
+            name=f"wasabi-client-{idx:03}",
+            image=f"{self.args.image_prefix}wasabi-client:{version}",
+            env={
+                "ADDR_BTC_NODE": self.args.btc_node_ip or self.node.internal_ip,
+                "ADDR_WASABI_BACKEND": self.args.wasabi_backend_ip or backend_address,
+                "WASABI_ANON_SCORE_TARGET": (str(anon_score_target) if anon_score_target else None),
+                "WASABI_REDCOIN_ISOLATION": (str(redcoin_isolation) if redcoin_isolation else None),
+            },
+            ports=self.client_ports({37128: 37132 + idx}),
+            cpu=(0.3 if version < "2.0.4" else 0.1),
+            memory=(1024 if version < "2.0.4" else 768),
+            healthcheck=tcp_probe(37128),
+        )
+
+    def client_groups(self, indexed_wallets):
+        size = self.args.wallets_per_container
+        if size <= 1:
+            return super().client_groups(indexed_wallets)
+
+        # a daemon serves several wallets from version 2.0.4 on, but its
+        # anon score target and red coin isolation apply to all of them
+        groups = []
+        open_groups = {}
+        for idx, wallet in indexed_wallets:
+            version = wallet.version or self.scenario.default_version
+            if version < "2.0.4":
+                groups.append([(idx, wallet)])
+                continue
+            wasabi_config = wallet.wasabi
+            key = (
+                version,
+                wasabi_config.anon_score_target if wasabi_config else self.scenario.default_anon_score_target,
+                wasabi_config.redcoin_isolation if wasabi_config else self.scenario.default_redcoin_isolation,
             )
-        except Exception as e:
-            print(f"- could not start {name} ({e})")
-            return None
+            group = open_groups.get(key)
+            if group is None:
+                group = open_groups[key] = []
+                groups.append(group)
+            group.append((idx, wallet))
+            if len(group) == size:
+                del open_groups[key]
+        return groups
+
+    def checkpoint_paths(self):
+        paths = super().checkpoint_paths()
+        paths["wasabi-client-distributor"] = [CLIENT_DATA_DIR]
+        for client in self.clients:
+            paths[client.container] = [CLIENT_DATA_DIR]
+        return paths
+
+    def group_spec(self, group) -> dict:
+        spec = super().group_spec(group)
+        spec["memory"] += PACKED_WALLET_MEMORY * (len(group) - 1)
+        return spec
 
+    def connect_group(self, group, ip, ports):
+        if len(group) == 1:
+            return super().connect_group(group, ip, ports)
+
+        container = f"wasabi-client-{group[0][0]:03}"
+        host, port = self.client_endpoint(container, ip, ports, 37128)
+        start = time()
+        if not self.driver.wait_healthy(container, timeout=CLIENT_START_TIMEOUT):
+            print(f"- could not start {container} (health check timeout {time() - start} seconds)")
+            return [None] * len(group)
+
+        clients = []
+        for idx, wallet in group:
+            client = self.init_wasabi_client(
+                wallet.version or self.scenario.default_version,
+                host,
+                port,
+                f"wasabi-client-{idx:03}",
+                (wallet.delay_blocks or 0, wallet.delay_rounds or 0),
+                (wallet.stop_blocks or 0, wallet.stop_rounds or 0),
+                wallet.wasabi.skip_rounds if wallet.wasabi else None,
+                wallet_name=f"wallet-{idx:03}",
+                container=container,
+            )
+            if not client.wait_wallet(timeout=60):
+                print(f"- could not start {client.name} in {container} (application timeout {time() - start} seconds)")
+                client = None
+            clients.append(client)
+        print(f"- started {container} with {len(group)} wallets (wait took {time() - start} seconds)")
+        return clients
+
+    def connect_client(self, idx: int, wallet: WalletConfig, ip, manager_ports):
+        version = wallet.version or self.scenario.default_version
+        name = f"wasabi-client-{idx:03}"
         delay = (wallet.delay_blocks or 0, wallet.delay_rounds or 0)
         stop = (wallet.stop_blocks or 0, wallet.stop_rounds or 0)
+        host, port = self.client_endpoint(name, ip, manager_ports, 37128)
         client = self.init_wasabi_client(
             version,
-            ip if self.args.proxy else self.args.control_ip,
-            37128 if self.args.proxy else manager_ports[37128],
-            f"wasabi-client-{idx:03}",
+            host,
+            port,
+            name,
             delay,
             stop,
+            wallet.wasabi.skip_rounds if wallet.wasabi else None,
         )
 
         start = time()
+        # wait for the RPC listener once instead of polling the starting daemon
+        if not self.driver.wait_healthy(name, timeout=CLIENT_START_TIMEOUT):
+            print(f"- could not start {name} (health check timeout {time() - start} seconds)")
+            return None
         if not client.wait_wallet(timeout=60):
             print(f"- could not start {name} (application timeout {time() - start} seconds)")
             return None
@@ -277,6 +380,7 @@ class WasabiEngine(EngineBase):
                     "wasabi-backend",
                     "/home/wasabi/.walletwasabi/backend/",
                     os.path.join(data_path, "wasabi-backend-2.6"),
+                    compress=self.args.compress_logs,
                 )
                 print(f"- stored backend-2.6 logs")
 
@@ -285,6 +389,7 @@ class WasabiEngine(EngineBase):
                         "wasabi-coordinator",
                         "/home/wasabi/.walletwasabi/coordinator/",
                         os.path.join(data_path, "wasabi-coordinator"),
+                        compress=self.args.compress_logs,
                     )
                     print(f"- stored coordinator logs")
                 except:
@@ -295,75 +400,115 @@ class WasabiEngine(EngineBase):
                     "wasabi-backend",
                     "/home/wasabi/.walletwasabi/backend/",
                     os.path.join(data_path, "wasabi-backend"),
+                    compress=self.args.compress_logs,
                 )
                 print(f"- stored backend logs")
         except:
             print(f"- could not store backend logs")
 
-    def start_coinjoin(self, client):
+    def set_coinjoin(self, client, active):
         sleep(random.random() / 10)
-        client.start_coinjoin()
-
-    def stop_coinjoin(self, client):
-        sleep(random.random() / 10)
-        client.stop_coinjoin()
+        try:
+            if active:
+                client.start_coinjoin()
+            else:
+                client.stop_coinjoin()
+        except Exception as e:
+            print(f"- could not {'start' if active else 'stop'} mixing {client.name} ({e})")
+            self.activation.invalidate(client.name)
+            return
+        self.activation.confirm(client, active)
 
     def update_coinjoins(self):
-        def start_condition(client):
-            if client.stop[0] > 0 and self.current_block >= client.stop[0]:
-                return False
-            if client.stop[1] > 0 and self.current_round >= client.stop[1]:
-                return False
-            if self.current_block < client.delay[0]:
-                return False
-            if self.current_round < client.delay[1]:
-                return False
-            return True
-
-        start, stop = [], []
-        for client in self.clients:
-            if start_condition(client):
-                start.append(client)
-            else:
-                stop.append(client)
+        if self.activation is None:
+            self.activation = ActivationSchedule(self.clients)
 
-        with multiprocessing.pool.ThreadPool() as pool:
-            pool.starmap(self.start_coinjoin, ((client,) for client in start))
+        start, stop = self.activation.advance(self.current_block, self.current_round)
+        if not start and not stop:
+            return
 
         with multiprocessing.pool.ThreadPool() as pool:
-            pool.starmap(self.stop_coinjoin, ((client,) for client in stop))
+            pool.starmap(
+                self.set_coinjoin,
+                [(client, True) for client in start] + [(client, False) for client in stop],
+            )
+
+    def send_batch(self, batch):
+        if self.distributor is None:
+            raise RuntimeError("Distributor is not initialized")
+        if self.coin_index is None:
+            self.coin_index = CoinIndex(self.distributor.list_unspent_coins)
+        coins = self.coin_index.select(sum(amount for _, amount in batch), len(batch), self.estimate_fee_rate())
+        try:
+            result = self.distributor.send(batch, coins)
+        except Exception:
+            self.coin_index.release(coins)
+            raise
+        if str(result) == "timeout":
+            self.coin_index.release(coins)
+        else:
+            self.coin_index.spend(coins)
+        return result
+
+    def estimate_fee_rate(self):
+        """Fee rate in sat/vB to reserve coins for, estimated once per block."""
+        if self.fee_rate is None:
+            try:
+                # BTC/kvB
+                estimate = self.node.estimate_smart_fee(2) if self.node is not None else None
+            except Exception:
+                estimate = None
+            if isinstance(estimate, (int, float)):
+                self.fee_rate = estimate * BTC / 1000 * FEE_RATE_MARGIN
+            else:
+                self.fee_rate = DEFAULT_FEE_RATE * FEE_RATE_MARGIN
+        return self.fee_rate
+
+    def pay_invoices(self, addressed_invoices):
+        super().pay_invoices(addressed_invoices)
+        # wallets stop mixing once all their coins are mixed, so newly funded
+        # wallets are re-activated on payment and again once the funds confirm
+        for address, _ in addressed_invoices:
+            owner = self.invoice_owners.get(address)
+            if owner is not None:
+                self.funded_clients.add(owner)
+                if self.activation is not None:
+                    self.activation.invalidate(owner)
+
+    def limit_reached(self):
+        return (self.scenario.rounds != 0 and self.current_round > self.scenario.rounds) or (
+            self.scenario.blocks != 0 and self.current_block >= self.scenario.blocks
+        )
+
+    def on_block(self, block):
+        self.fee_rate = None
+        if self.coin_index is not None:
+            # change outputs of earlier payments are spendable once confirmed
+            self.coin_index.invalidate()
+        if self.activation is not None:
+            for name in self.funded_clients:
+                self.activation.invalidate(name)
+        self.funded_clients.clear()
+        super().on_block(block)
+        self.update_coinjoins()
+
+    def on_round(self, round):
+        super().on_round(round)
+        self.update_coinjoins()
 
     def run_engine(self):
         print("Running simulation")
         if self.node is None:
             raise RuntimeError("Bitcoin node is not initialized")
-        initial_block = self.node.get_block_count()
-        while (self.scenario.rounds == 0 or self.current_round <= self.scenario.rounds) and (
-            self.scenario.blocks == 0 or self.current_block < self.scenario.blocks
-        ):
-            for _ in range(3):
-                try:
-                    self.current_round = self._get_current_round()
-                    break
-                except Exception as e:
-                    print(f"- could not get rounds".ljust(60), end="\r")
-                    print(f"Round exception: {e}", file=sys.stderr)
-
-            for _ in range(3):
-                try:
-                    self.current_block = self.node.get_block_count() - initial_block  # type: ignore
-                    break
-                except Exception as e:
-                    print(f"- could not get blocks".ljust(60), end="\r")
-                    print(f"Block exception: {e}", file=sys.stderr)
-
-            self.update_invoice_payments()
-            self.update_coinjoins()
-            print(
-                f"- coinjoin rounds: {self.current_round} (block {self.current_block})".ljust(60),
-                end="\r",
-            )
-            sleep(1)
+        node = self.node
+        initial_block = node.get_block_count()
+        self.activation = ActivationSchedule(self.clients)
+
+        self.scheduler.on("rounds", self.on_round)
+        self.scheduler.on("blocks", self.on_block)
+        self.scheduler.watch("rounds", self._get_current_round)
+        self.scheduler.watch("blocks", lambda: node.get_block_count() - initial_block)
+        self.scheduler.run(until=self.limit_reached)
         print()
         print(f"- limit reached")
 
@@ -379,11 +524,11 @@ class WasabiEngine(EngineBase):
 
         else:
             # In legacy versions, rounds are tracked by the backend
-            return sum(
-                1
-                for _ in self.driver.peek(
+            if self.round_store is None:
+                self.round_store = FileFollower(
+                    self.driver,
                     "wasabi-backend",
                     "/home/wasabi/.walletwasabi/backend/WabiSabi/CoinJoinIdStore.txt",
-                ).split("\n")[:-1]
-            )
-
+                )
+            self.stored_rounds += self.round_store.read().count(b"\n")
+            return self.stored_rounds
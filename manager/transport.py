@@ -0,0 +1,93 @@
+"""Pooled keep-alive HTTP transport shared by the RPC wrappers."""
+
+import json
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode()
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class Transport:
+    """Keeps one keep-alive session per endpoint and proxy.
+
+    Connections to an endpoint are pooled and reused across calls and
+    threads, including connections tunnelled through a SOCKS proxy.
+    """
+
+    def __init__(self, pool_size=64):
+        self.pool_size = pool_size
+        self._sessions: dict[tuple[str, str], requests.Session] = {}
+        self._lock = threading.Lock()
+
+    def session(self, url, proxy=""):
+        parts = urlsplit(url)
+        key = (f"{parts.scheme}://{parts.netloc}", proxy)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                # HTTPS too: JoinMarket wallet RPCs are tunnelled like the other clients' RPCs
+                session.proxies = dict(http=proxy, https=proxy)
+                self._sessions[key] = session
+        return session
+
+    def request(self, method, url, proxy="", **kwargs) -> requests.Response:
+        return self.session(url, proxy).request(method, url, **kwargs)
+
+    def post(self, url, payload, proxy="", **kwargs) -> requests.Response:
+        headers = {"Content-Type": "application/json"}
+        return self.request("POST", url, proxy, data=dumps(payload), headers=headers, **kwargs)
+
+    def get(self, url, proxy="", **kwargs) -> requests.Response:
+        return self.request("GET", url, proxy, **kwargs)
+
+    def _pools(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+        for session in sessions:
+            adapter = session.get_adapter("http://")
+            managers = [adapter.poolmanager, *adapter.proxy_manager.values()]
+            for manager in managers:
+                for key in manager.pools.keys():
+                    pool = manager.pools.get(key)
+                    if pool is not None:
+                        yield pool
+
+    def stats(self):
+        """Return the number of connections opened and requests served on reused ones."""
+        opened = requests_sent = 0
+        for pool in self._pools():
+            opened += pool.num_connections
+            requests_sent += pool.num_requests
+        return {"opened": opened, "reused": max(requests_sent - opened, 0)}
+
+    def close(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+
+transport = Transport()
@@ -2,3 +2,11 @@ def batched(data, batch_size=1):
     length = len(data)
     for ndx in range(0, length, batch_size):
         yield data[ndx : min(ndx + batch_size, length)]
+
+
+def backoff(initial=0.1, maximum=5.0, factor=2.0):
+    """Yield exponentially growing retry delays capped at `maximum`."""
+    delay = initial
+    while True:
+        yield delay
+        delay = min(delay * factor, maximum)
@@ -1,7 +1,8 @@
-import json
 import requests
 from time import sleep
 
+from manager.transport import transport, loads
+
 WALLET_NAME = "wallet"
 
 
@@ -16,27 +17,28 @@ class WasabiBackend:
         request["jsonrpc"] = "2.0"
         request["id"] = "1"
         try:
-            response = requests.post(
+            response = transport.post(
                 f"http://{self.host}:{self.port}/{WALLET_NAME}",
-                data=json.dumps(request),
-                proxies=dict(http=self.proxy),
+                request,
+                self.proxy,
                 timeout=5,
             )
         except requests.exceptions.Timeout:
             return "timeout"
-        if "error" in response.json():
-            raise Exception(response.json()["error"])
-        if "result" in response.json():
-            return response.json()["result"]
+        response = loads(response.content)
+        if "error" in response:
+            raise Exception(response["error"])
+        if "result" in response:
+            return response["result"]
         return None
 
     def _get_status(self):
-        response = requests.get(
+        response = transport.get(
             f"http://{self.host}:{self.port}/api/v4/btc/Blockchain/status",
-            proxies=dict(http=self.proxy),
+            self.proxy,
             timeout=5,
         )
-        return response.json()
+        return loads(response.content)
 
     def wait_ready(self):
         while True:
@@ -0,0 +1,109 @@
+"""Local index of the coins a Wasabi wallet can spend."""
+
+import bisect
+import threading
+
+# virtual sizes of a P2WPKH transaction, its inputs and its outputs
+TX_VBYTES = 11
+INPUT_VBYTES = 68
+OUTPUT_VBYTES = 31
+
+
+def outpoint(coin):
+    return coin["txid"], coin["index"]
+
+
+def estimate_fee(inputs, outputs, fee_rate):
+    """Fee in satoshis of a transaction with the given number of inputs and outputs at `fee_rate` sat/vB."""
+    return int(fee_rate * (TX_VBYTES + INPUT_VBYTES * inputs + OUTPUT_VBYTES * outputs)) + 1
+
+
+class CoinIndex:
+    """Amount-sorted index of spendable coins, shared by concurrent sends.
+
+    The index is filled from `list_coins` (a `listunspentcoins` call) only
+    when it is stale or cannot cover a payment, not for every send. Selected
+    coins are reserved until the send is done, so concurrent batches never
+    pick the same coin; spent coins are kept out until the wallet stops
+    listing them, and coins of a failed send until the next block.
+    """
+
+    def __init__(self, list_coins):
+        self.list_coins = list_coins
+        self._coins: list[tuple[int, str, int]] = []
+        self._reserved: set[tuple[str, int]] = set()
+        self._spent: set[tuple[str, int]] = set()
+        self._failed: set[tuple[str, int]] = set()
+        self._stale = True
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._coins)
+
+    def invalidate(self):
+        """Refresh the index before the next selection, e.g. after a block confirms change outputs."""
+        with self._lock:
+            self._failed.clear()
+            self._stale = True
+
+    def _refresh(self):
+        coins = self.list_coins()
+        if not isinstance(coins, list):
+            raise Exception(f"could not list coins ({coins})")
+        listed = {outpoint(coin): coin["amount"] for coin in coins}
+        self._spent &= listed.keys()
+        self._coins = sorted(
+            (amount, *key)
+            for key, amount in listed.items()
+            if key not in self._reserved and key not in self._spent and key not in self._failed
+        )
+        self._stale = False
+
+    def _pick(self, cost, outputs, fee_rate):
+        # the smallest coin covering the cost and the fee, otherwise the largest coins until they do;
+        # one more output is counted for the change
+        needed = cost + estimate_fee(1, outputs + 1, fee_rate)
+        idx = bisect.bisect_right(self._coins, needed, key=lambda coin: coin[0])
+        if idx < len(self._coins):
+            return [self._coins.pop(idx)]
+        picked, total = [], 0
+        for coin in reversed(self._coins):
+            picked.append(coin)
+            total += coin[0]
+            if total > cost + estimate_fee(len(picked), outputs + 1, fee_rate):
+                del self._coins[-len(picked) :]
+                return picked
+        return None
+
+    def select(self, cost, outputs=1, fee_rate=0.0):
+        """Reserve coins worth more than `cost` satoshis plus the fee of paying `outputs` outputs at `fee_rate` sat/vB."""
+        with self._lock:
+            if self._stale:
+                self._refresh()
+            picked = self._pick(cost, outputs, fee_rate)
+            if picked is None:
+                # change of earlier sends is only seen after a refresh
+                self._refresh()
+                picked = self._pick(cost, outputs, fee_rate)
+            if picked is None:
+                raise Exception("Not enough BTC")
+            coins = [{"txid": txid, "index": index, "amount": amount} for amount, txid, index in picked]
+            self._reserved.update(map(outpoint, coins))
+            return coins
+
+    def release(self, coins):
+        """Release coins of a failed send; they are offered again only after `invalidate`.
+
+        A retry of the batch then picks other coins, and a send that failed
+        after all (e.g. on a timeout) cannot be double-spent.
+        """
+        with self._lock:
+            for coin in coins:
+                self._reserved.discard(outpoint(coin))
+                self._failed.add(outpoint(coin))
+
+    def spend(self, coins):
+        with self._lock:
+            for coin in coins:
+                self._reserved.discard(outpoint(coin))
+                self._spent.add(outpoint(coin))
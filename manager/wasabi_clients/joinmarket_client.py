@@ -1,10 +1,12 @@
-import json
 
 import requests
 from time import sleep, time
 from urllib3.exceptions import InsecureRequestWarning
 import urllib3
 
+from manager.transport import transport, dumps, loads
+from manager.utils import backoff
+
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 
@@ -33,11 +35,14 @@ class JoinMarketClientServer:
         type="maker",
         delay=(0, 0),
         stop=(0, 0),
+        container=None,
     ):
         self.host = host
         self.port = port
         self.walletname = walletname  # Store walletname as an instance variable
         self.name = name
+        # name of the container, shared when several wallets are packed in one
+        self.container = container or name
         self.proxy = proxy
         self.version = version
         self.type = type
@@ -56,12 +61,12 @@ class JoinMarketClientServer:
         response = None
         for _ in range(repeat):
             try:
-                response = requests.request(
-                    method=method,
-                    url=f"https://{self.host}:{self.port}/api/v1{endpoint}",
-                    json=json_data or {},
-                    headers=headers,
-                    proxies=dict(http=self.proxy),
+                response = transport.request(
+                    method,
+                    f"https://{self.host}:{self.port}/api/v1{endpoint}",
+                    self.proxy,
+                    data=dumps(json_data or {}),
+                    headers={**headers, "Content-Type": "application/json"},
                     timeout=timeout,
                     verify=False,
                 )
@@ -80,16 +85,17 @@ class JoinMarketClientServer:
 
             if response.status_code >= 400:
                 try:
-                    print(response.json())
-                    error_message = response.json().get("message", "Unknown error")
-                except json.JSONDecodeError:
+                    error = loads(response.content)
+                    print(error)
+                    error_message = error.get("message", "Unknown error")
+                except ValueError:
                     error_message = response.text
                 raise Exception(f"Error {response.status_code}: {error_message}")
 
-            return response.json()
+            return loads(response.content)
 
         if response is not None:
-            return response.json()
+            return loads(response.content)
 
         raise Exception("timeout")
 
@@ -129,19 +135,24 @@ class JoinMarketClientServer:
 
     def wait_wallet(self, timeout=None):
         start = time()
+        delays = backoff()
         while timeout is None or time() - start < timeout:
             try:
                 self._create_wallet()
-            except Exception as e:
-                pass
+            except Exception:
+                # the wallet already exists, e.g. restored from a checkpoint
+                try:
+                    self.unlock_wallet()
+                except Exception:
+                    pass
 
             try:
                 self.get_balance()
                 return True
-            except Exception as e:
+            except Exception:
                 pass
 
-            sleep(0.1)
+            sleep(next(delays))
         return False
 
 
@@ -1,8 +1,10 @@
-import json
 import random
 import requests
 from time import sleep, time
 
+from manager.transport import transport, loads
+from manager.utils import backoff
+
 WALLET_NAME = "wallet"
 
 
@@ -16,6 +18,9 @@ class WasabiClientBase:
         version="2.0.4",
         delay=(0, 0),
         stop=(0, 0),
+        skip_rounds=None,
+        wallet_name=WALLET_NAME,
+        container=None,
     ):
         self.host = host
         self.port = port
@@ -24,6 +29,10 @@ class WasabiClientBase:
         self.version = version
         self.delay = delay
         self.stop = stop
+        self.skip_rounds = skip_rounds or []
+        self.wallet_name = wallet_name
+        # name of the daemon container, shared when several wallets are packed in one
+        self.container = container or name
 
     def _rpc(self, request, wallet=True, timeout=5, repeat=1, wallet_name=None):
         request["jsonrpc"] = "2.0"
@@ -34,18 +43,19 @@ class WasabiClientBase:
 
         for _ in range(repeat):
             try:
-                response = requests.post(
-                    f"http://{self.host}:{self.port}/{(wallet_name or WALLET_NAME) if wallet else ''}",
-                    data=json.dumps(request),
-                    proxies=dict(http=self.proxy),
+                response = transport.post(
+                    f"http://{self.host}:{self.port}/{(wallet_name or self.wallet_name) if wallet else ''}",
+                    request,
+                    self.proxy,
                     timeout=timeout,
                 )
             except requests.exceptions.Timeout:
                 continue
-            if "error" in response.json():
-                raise Exception(response.json()["error"])
-            if "result" in response.json():
-                return response.json()["result"]
+            response = loads(response.content)
+            if "error" in response:
+                raise Exception(response["error"])
+            if "result" in response:
+                return response["result"]
             return None
         return "timeout"
 
@@ -58,7 +68,7 @@ class WasabiClientBase:
     def _create_wallet(self, wallet_name: str | None = None):
         request = {
             "method": "createwallet",
-            "params": [wallet_name or WALLET_NAME, ""],
+            "params": [wallet_name or self.wallet_name, ""],
         }
         return self._rpc(request)
 
@@ -78,6 +88,7 @@ class WasabiClientBase:
 
     def wait_wallet(self, timeout=None):
         start = time()
+        delays = backoff()
         while timeout is None or time() - start < timeout:
             try:
                 self._create_wallet()
@@ -90,7 +101,7 @@ class WasabiClientBase:
             except:
                 pass
 
-            sleep(0.1)
+            sleep(next(delays))
         return False
 
     def _list_unspent_coins(self):
@@ -99,19 +110,22 @@ class WasabiClientBase:
         }
         return self._rpc(request)
 
-    def send(self, invoices):
-        unspent_coins = self._list_unspent_coins()
-        random.shuffle(unspent_coins)
-
-        cost = sum(map(lambda x: x[1], invoices))
-        coins = []
-        for coin in unspent_coins:
-            coins.append({"transactionid": coin["txid"], "index": coin["index"]})
-            cost -= coin["amount"]
-            if cost < 0:
-                break
-        else:
-            raise Exception("Not enough BTC")
+    def send(self, invoices, coins=None):
+        """Pay invoices, spending `coins` (e.g. reserved in a CoinIndex) or coins picked at random."""
+        if coins is None:
+            unspent_coins = self._list_unspent_coins()
+            random.shuffle(unspent_coins)
+
+            cost = sum(map(lambda x: x[1], invoices))
+            coins = []
+            for coin in unspent_coins:
+                coins.append(coin)
+                cost -= coin["amount"]
+                if cost < 0:
+                    break
+            else:
+                raise Exception("Not enough BTC")
+        coins = [{"transactionid": coin["txid"], "index": coin["index"]} for coin in coins]
 
         payments = list(map(lambda x: {"sendto": x[0], "amount": x[1]}, invoices))
 
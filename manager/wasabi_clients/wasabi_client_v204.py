@@ -1,4 +1,4 @@
-from .wasabi_client_base import WasabiClientBase
+from .wasabi_client_base import WasabiClientBase, WALLET_NAME
 
 
 class WasabiClientV204(WasabiClientBase):
@@ -12,5 +12,8 @@ class WasabiClientV204(WasabiClientBase):
         version="2.0.4",
         delay=(0, 0),
         stop=(0, 0),
+        skip_rounds=None,
+        wallet_name=WALLET_NAME,
+        container=None,
     ):
-        super().__init__(host, port, name, proxy, version, delay, stop)
+        super().__init__(host, port, name, proxy, version, delay, stop, skip_rounds, wallet_name, container)
@@ -1,4 +1,5 @@
 from time import time, sleep
+from manager.utils import backoff
 from traceback import print_exception
 
 from .wasabi_client_base import WALLET_NAME, WasabiClientBase
@@ -15,12 +16,15 @@ class WasabiClientV26(WasabiClientBase):
         version="2.6.0",
         delay=(0, 0),
         stop=(0, 0),
+        skip_rounds=None,
+        wallet_name=WALLET_NAME,
+        container=None,
     ):
-        super().__init__(host, port, name, proxy, version, delay, stop)
+        super().__init__(host, port, name, proxy, version, delay, stop, skip_rounds, wallet_name, container)
 
     def wait_wallet(self, timeout=None):
         start = time()
-        counter = 0
+        delays = backoff()
         while timeout is None or time() - start < timeout:
             try:
                 self._create_wallet()
@@ -33,5 +37,5 @@ class WasabiClientV26(WasabiClientBase):
             except Exception as e:
                 pass
 
-            sleep(1)
+            sleep(next(delays))
         return False
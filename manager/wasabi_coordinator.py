@@ -1,7 +1,8 @@
 from traceback import print_exception
-import requests
 from time import sleep
 
+from manager.transport import transport, loads
+
 
 class WasabiCoordinator:
     def __init__(self, host="localhost", port=37128, internal_ip="", proxy=""):
@@ -13,12 +14,12 @@ class WasabiCoordinator:
     def _get_status(self):
         """Get coordinator status"""
         try:
-            response = requests.get(
+            response = transport.get(
                 f"http://{self.host}:{self.port}/wabisabi/human-monitor",
-                proxies=dict(http=self.proxy),
+                self.proxy,
                 timeout=5,
             )
-            return response.json()
+            return loads(response.content)
         except Exception:
             return None
 
@@ -26,12 +27,12 @@ class WasabiCoordinator:
         """Get active coinjoin rounds"""
         try:
             print(self.host, self.port, self.proxy)
-            response = requests.get(
+            response = transport.get(
                 f"http://{self.host}:{self.port}/wabisabi/human-monitor",
-                proxies=dict(http=self.proxy),
+                self.proxy,
                 timeout=5,
             )
-            return response.json()
+            return loads(response.content)
         except Exception as e:
             print_exception(e)
             return None